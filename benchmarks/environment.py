@@ -0,0 +1,20 @@
+"""
+Sets up just enough of django for the benchmarks to drive the wizard
+without a project: the wizard's test urls and an in memory database.
+"""
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def configure():
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(
+            ROOT_URLCONF='wizard.test_urls',
+            DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+            WIZARD_TEMPLATE_AUTO_RELOAD=False,
+        )
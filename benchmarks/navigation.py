@@ -0,0 +1,63 @@
+"""
+Shows that step navigation cost stays flat as the number of steps grows:
+looking up a step's position takes the same time for any number of steps,
+and skipping ahead over steps with missing prereqs costs the same per step
+skipped (so a walk over N steps is linear, not quadratic).
+
+    python benchmarks/navigation.py
+"""
+import timeit
+
+import environment
+environment.configure()
+
+import wizard
+
+STEP_COUNTS = (5, 50, 500, 5000)
+REPEAT = 20000
+HOPS = 100000
+
+
+class Step(object):
+    def prereq(self):
+        pass
+
+
+class SkippedStep(Step):
+    """a step the wizard skips over when moving forward"""
+
+    def prereq(self):
+        raise wizard.PrereqMissing()
+
+
+def build_wizard(step_count, step_class=Step):
+    steps = [('step%d' % i, step_class) for i in range(step_count)]
+    steps[-1] = ('step%d' % (step_count - 1), Step)
+    wiz = wizard.Wizard('test:test1', steps)
+    wiz.initialize_steps()
+    return wiz
+
+
+def time_per_call(func, number=REPEAT):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    print "%8s %18s %18s %18s" % ('steps', 'position (us)', 'skip-ahead (us)', 'per hop (us)')
+    for step_count in STEP_COUNTS:
+        wiz = build_wizard(step_count)
+        last_key = wiz.get_step_key_by_position(step_count - 1)
+        position = time_per_call(lambda: wiz.get_step_position(last_key))
+
+        # walk forward from the first step over step_count - 2 missing prereqs
+        skipping = build_wizard(step_count, SkippedStep)
+        first_key = skipping.get_step_key_by_position(1)
+        hops = step_count - 2
+        walk = lambda: (skipping.clear_prereq_results(), skipping.handle_prereq(first_key, 1))
+        skip_ahead = time_per_call(walk, number=max(1, HOPS // max(hops, 1)))
+        per_hop = skip_ahead / max(hops, 1)
+        print "%8d %18.3f %18.3f %18.3f" % (step_count, position, skip_ahead, per_hop)
+
+
+if __name__ == '__main__':
+    main()
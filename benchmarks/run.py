@@ -0,0 +1,242 @@
+"""
+Benchmarks Wizard.handle_request, driven through django's RequestFactory.
+
+    python benchmarks/run.py                    # run and compare with baseline.json
+    python benchmarks/run.py --update-baseline  # run and write baseline.json
+    python benchmarks/run.py get_50 post_50     # only run some scenarios
+
+For each scenario it reports requests per second, database queries per
+request and the objects left behind per request (which should be 0). Since
+raw speed depends on the machine, requests per second are also reported
+relative to a fixed pure python workload timed just before each scenario
+("score"), and it is the score that
+is compared with the baseline. Exits with 1 when a scenario is slower than
+the baseline by more than the tolerance or makes more queries.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+from timeit import default_timer
+
+import environment
+environment.configure()
+
+from django.db import connection
+from django.template import Template
+from django.test.client import RequestFactory
+
+import wizard
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+MIN_TIME = 0.2
+REPEAT = 3
+LEAK_CHECK_REQUESTS = 100
+
+factory = RequestFactory()
+
+
+class Step(object):
+    template_name = 'benchmark_step.html'
+    template_source = Template("{{ step_key }}{% for item in items %}<li>{{ item }}</li>{% endfor %}")
+
+    def __init__(self, request):
+        self.request = request
+
+    def prereq(self):
+        pass
+
+    def display(self):
+        return {'items': range(10)}
+
+    def save(self):
+        pass
+
+    def template(self):
+        return self.template_source
+
+
+class QueryStep(Step):
+    """a step whose prereq hits the database"""
+
+    def prereq(self):
+        connection.cursor().execute("SELECT 1")
+
+
+class MissingStep(Step):
+    """a step whose prereq is never met, sending the wizard to the previous step"""
+
+    def prereq(self):
+        connection.cursor().execute("SELECT 1")
+        raise wizard.PrereqMissing('step%d' % (int(self._key[4:]) - 1))
+
+
+class SkippedStep(Step):
+    """a step the wizard skips over when moving forward"""
+
+    def prereq(self):
+        raise wizard.PrereqMissing()
+
+
+def steps(count, step_class=Step, first_class=Step):
+    return [('step0', first_class)] + [('step%d' % i, step_class) for i in range(1, count)]
+
+
+def make_handler(wizard_factory, request, step):
+    def handle():
+        wiz = wizard_factory()
+        wiz.set_step_init_args(request)
+        return wiz.handle_request(request, step)
+    return handle
+
+
+def wizard_scenario(step_list, request, step):
+    return make_handler(lambda: wizard.Wizard('test:test1', step_list), request, step)
+
+
+def get_scenario(count):
+    return wizard_scenario(steps(count), factory.get('/test/step%d' % (count // 2)), 'step%d' % (count // 2))
+
+
+def definition_scenario(count):
+    definition = wizard.WizardDefinition('test:test1', steps(count))
+    return make_handler(definition.create_wizard, factory.get('/test/step1'), 'step1')
+
+
+def steps_callback_scenario(count):
+    step_list = steps(count)
+    return wizard_scenario(lambda request: step_list, factory.get('/test/step1'), 'step1')
+
+
+def post_scenario(count):
+    return wizard_scenario(steps(count), factory.post('/test/step1', {'wizard_continue': '1'}), 'step1')
+
+
+def skip_ahead_scenario(count):
+    step_list = steps(count, SkippedStep)
+    step_list[-1] = ('step%d' % (count - 1), Step)
+    return wizard_scenario(step_list, factory.post('/test/step0', {'wizard_next': '1'}), 'step0')
+
+
+def prereq_chain_scenario(count):
+    last = 'step%d' % (count - 1)
+    return wizard_scenario(steps(count, MissingStep, QueryStep), factory.get('/test/' + last), last)
+
+
+SCENARIOS = (
+    ('get_5', lambda: get_scenario(5)),
+    ('get_50', lambda: get_scenario(50)),
+    ('get_500', lambda: get_scenario(500)),
+    ('definition_get_50', lambda: definition_scenario(50)),
+    ('steps_callback_50', lambda: steps_callback_scenario(50)),
+    ('post_50', lambda: post_scenario(50)),
+    ('skip_ahead_500', lambda: skip_ahead_scenario(500)),
+    ('prereq_chain_50', lambda: prereq_chain_scenario(50)),
+)
+
+
+def calibrate():
+    """runs per second of a fixed pure python workload on this machine"""
+    def workload():
+        return sum(len(str(i)) for i in xrange(10000))
+    return requests_per_second(workload)
+
+
+def timed(func, number):
+    start = default_timer()
+    for _ in xrange(number):
+        func()
+    return (default_timer() - start) / number
+
+
+def requests_per_second(handle):
+    """the best of REPEAT runs, each taking at least MIN_TIME"""
+    number = 1
+    while timed(handle, number) * number < MIN_TIME:
+        number *= 2
+    return 1 / min(timed(handle, number) for _ in range(REPEAT))
+
+
+def queries_per_request(handle):
+    connection.use_debug_cursor = True
+    del connection.queries[:]
+    try:
+        handle()
+        return len(connection.queries)
+    finally:
+        connection.use_debug_cursor = False
+
+
+def objects_left_per_request(handle):
+    gc.collect()
+    before = len(gc.get_objects())
+    for _ in xrange(LEAK_CHECK_REQUESTS):
+        handle()
+    gc.collect()
+    return max(0, len(gc.get_objects()) - before) // LEAK_CHECK_REQUESTS
+
+
+def run_scenario(build):
+    handle = build()
+    handle()
+    calibration = calibrate()
+    rps = requests_per_second(handle)
+    return {
+        'requests_per_second': round(rps, 1),
+        'score': round(rps / calibration * 1000, 3),
+        'queries': queries_per_request(handle),
+        'objects_left': objects_left_per_request(handle),
+    }
+
+
+def compare(name, result, baseline, tolerance):
+    """returns a list of the ways result is worse than the baseline"""
+    problems = []
+    if name not in baseline:
+        return problems
+    expected = baseline[name]
+    if result['score'] < expected['score'] * (1 - tolerance):
+        problems.append("score %s is more than %d%% below baseline %s" % (
+            result['score'], tolerance * 100, expected['score']))
+    if result['queries'] > expected['queries']:
+        problems.append("%s queries, baseline %s" % (result['queries'], expected['queries']))
+    if result['objects_left'] > expected['objects_left']:
+        problems.append("%s objects left per request, baseline %s" % (result['objects_left'], expected['objects_left']))
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', help="names of the scenarios to run (default: all)")
+    parser.add_argument('--update-baseline', action='store_true', help="write the results to the baseline file")
+    parser.add_argument('--baseline', default=BASELINE, help="baseline file (default: %(default)s)")
+    parser.add_argument('--tolerance', type=float, default=0.5,
+        help="allowed drop in score before failing, as a fraction (default: %(default)s)")
+    options = parser.parse_args(argv)
+
+    scenarios = [(name, build) for name, build in SCENARIOS if not options.scenarios or name in options.scenarios]
+    baseline = {}
+    if os.path.exists(options.baseline) and not options.update_baseline:
+        with open(options.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    failed = False
+    print "%-20s %12s %10s %8s %8s" % ('scenario', 'requests/s', 'score', 'queries', 'objects')
+    for name, build in scenarios:
+        result = results[name] = run_scenario(build)
+        problems = compare(name, result, baseline, options.tolerance)
+        failed = failed or bool(problems)
+        print "%-20s %12.1f %10.3f %8d %8d %s" % (name, result['requests_per_second'], result['score'],
+            result['queries'], result['objects_left'], '; '.join(problems) or '')
+
+    if options.update_baseline:
+        with open(options.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=4, sort_keys=True, separators=(',', ': '))
+            baseline_file.write('\n')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
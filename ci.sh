@@ -22,11 +22,14 @@ pep8 wizard > jenkins_reports/pep8.report
 PEP8_EXIT=$?
 pyflakes wizard > jenkins_reports/pyflakes.report
 PYFLAKES_EXIT=$?
-let JENKINS_EXIT="$TEST_EXIT + $PEP8_EXIT + $PYFLAKES_EXIT"
+python benchmarks/run.py > jenkins_reports/benchmark.report
+BENCHMARK_EXIT=$?
+let JENKINS_EXIT="$TEST_EXIT + $PEP8_EXIT + $PYFLAKES_EXIT + $BENCHMARK_EXIT"
 if [ $JENKINS_EXIT -gt 2 ]; then
     echo "Test exit status:" $TEST_EXIT
     echo "PEP8 exit status:" $PEP8_EXIT
     echo "Pyflakes exit status:" $PYFLAKES_EXIT
+    echo "Benchmark exit status:" $BENCHMARK_EXIT
     echo "Exiting Build with status:" $EXIT
     exit $JENKINS_EXIT
 fi
\ No newline at end of file
@@ -1,7 +1,7 @@
 from django.template import loader
 from django.forms import models as model_forms
 
-from wizard import Wizard
+from wizard import WizardDefinition
 
 from wizard import signals
 
@@ -91,10 +91,9 @@ wizard_steps = (
     ('three', StepThree),
 )
 
+wizard_definition = WizardDefinition('wizard', wizard_steps)
+
 def wizard_view(request, step):
-    wizard = Wizard(
-        'wizard',
-        wizard_steps
-    )
+    wizard = wizard_definition.create_wizard()
     wizard.set_step_init_args(request)
     return wizard.handle_request(request, step)
\ No newline at end of file
@@ -1,18 +1,148 @@
 
 import inspect
+import json
+import logging
+import threading
+import uuid
+from calendar import timegm
+from hashlib import md5
+from timeit import default_timer
 
 from django import http
+from django.conf import settings
 from django.core import urlresolvers
-from django.template import RequestContext
+from django.core.cache import get_cache
+from django.db import connections, transaction
+from django.core.context_processors import csrf
+from django.template import Context, RequestContext, loader
+from django.utils import translation
+from django.utils.encoding import force_unicode
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
 from django.contrib import messages
 from django.utils.functional import wraps
 
 from wizard import signals
+from wizard.cache import LRUCache
+from wizard.concurrency import get_thread_pool
+from wizard.context import LayeredDict, LazyDict
+from wizard.instrumentation import NULL_TIMER, Timings
+from wizard.navigation import Navigation
+from wizard.renderers import TemplateRenderer, choose_renderer
+from wizard.work import UnitOfWork
 
-__all__ = ('PrereqMissing', 'SaveStepException', 'Wizard')
+__all__ = ('PrereqMissing', 'PrereqResolutionError', 'SaveStepException', 'Wizard', 'WizardDefinition')
 
 __version__ = '0.2.7'
 
+WORK_STATE_KEY = '__work__'
+PARTIAL_PARAMETER = 'wizard_partial'
+PARTIAL_HEADER = 'HTTP_X_WIZARD_PARTIAL'
+
+_template_cache = {}
+_url_cache = LRUCache(max_size=1024)
+_prereq_thread = threading.local()
+
+
+def clear_template_cache():
+    """
+    Forgets every template cached by Wizard.get_template
+    """
+    _template_cache.clear()
+
+
+def clear_url_cache():
+    """
+    Forgets every url cached by reverse
+    """
+    _url_cache.clear()
+
+
+def run_prereq(step):
+    """
+    calls the step's prereq, returning None or the PrereqMissing it raised
+    along with how long it took. Used to run prereqs on a thread pool: the
+    messages of a PrereqMissing are kept for the request thread to add, and
+    the thread's database connections are closed so a pool thread doesn't
+    hang on to a connection (and its transaction) between requests.
+    """
+    start = default_timer()
+    _prereq_thread.defer_messages = True
+    try:
+        step.prereq()
+        result = None
+    except PrereqMissing as exception:
+        result = exception
+    finally:
+        _prereq_thread.defer_messages = False
+        for connection in connections.all():
+            connection.close()
+    return result, default_timer() - start
+
+
+def stream_template(template, context):
+    """
+    renders the template one top level node at a time. Each node is
+    rendered whole, so a template extending another one, or a loop, is a
+    single chunk: steps with large pages should define stream instead.
+    """
+    context.render_context.push()
+    try:
+        for node in template.nodelist:
+            yield force_unicode(template.nodelist.render_node(node, context))
+    finally:
+        context.render_context.pop()
+
+
+def reverse(viewname, args=None, kwargs=None):
+    """
+    django's reverse, with the result cached for the life of the process
+    (keyed by the url conf, script prefix, active language and arguments) so
+    each url is only worked out once. The language is part of the key for
+    i18n_patterns. Arguments that can't be hashed are not cached.
+    """
+    try:
+        key = (
+            urlresolvers.get_urlconf() or settings.ROOT_URLCONF,
+            urlresolvers.get_script_prefix(),
+            translation.get_language(),
+            viewname,
+            tuple(args or ()),
+            tuple(sorted((kwargs or {}).items())),
+        )
+        hash(key)
+    except TypeError:
+        return urlresolvers.reverse(viewname, args=args, kwargs=kwargs)
+
+    url = _url_cache.get(key)
+    if url is None:
+        url = urlresolvers.reverse(viewname, args=args, kwargs=kwargs)
+        _url_cache.set(key, url)
+    return url
+
+
+def get_request_owner(request):
+    """
+    tells the users of the wizard apart for keys of per user cache entries:
+    their session key, or their id when there is no session, or None
+    """
+    session = getattr(request, 'session', None)
+    user = getattr(request, 'user', None)
+    if session is not None and session.session_key:
+        return 'session:%s' % session.session_key
+    if user is not None and user.is_authenticated():
+        return 'user:%s' % user.pk
+    return None
+
+
+def invalidate_render_cache(sender, step_key, **kwargs):
+    """
+    wizard_post_save receiver throwing away the cached renders of the saved
+    step and of the steps that declare it in their render_cache_dependencies
+    """
+    if getattr(sender, 'render_cache', None) is not None:
+        sender.bump_render_generation(step_key)
+
 
 class PrereqMissing(Exception):
     """
@@ -27,10 +157,54 @@ class PrereqMissing(Exception):
         """
         self.step = step
         self.prereq_message = message
+        self.deferred_message = None
         if request and message:
+            if getattr(_prereq_thread, 'defer_messages', False):
+                self.deferred_message = (request, message)
+            else:
+                messages.add_message(request, messages.ERROR, message)
+
+    def add_deferred_message(self):
+        """
+        adds the message kept back while the prereq ran on a thread pool or
+        while the navigation menu was worked out. Messages are kept back for
+        longer when this is called while they are still being deferred.
+        """
+        if self.deferred_message is not None and not getattr(_prereq_thread, 'defer_messages', False):
+            request, message = self.deferred_message
+            self.deferred_message = None
             messages.add_message(request, messages.ERROR, message)
 
 
+class DeferredPrereqMessages(object):
+    """
+    A context manager keeping back the messages of the PrereqMissing
+    exceptions raised inside it, for add_deferred_message to add later.
+    """
+
+    def __enter__(self):
+        self.previous = getattr(_prereq_thread, 'defer_messages', False)
+        _prereq_thread.defer_messages = True
+
+    def __exit__(self, *exc_info):
+        _prereq_thread.defer_messages = self.previous
+
+
+class PrereqResolutionError(Exception):
+    """
+    Raised when the wizard can't find a step to go to because the missing
+    prereqs keep sending it around in a circle, or because it took more
+    than the wizard's max_prereq_hops to find one.
+    """
+
+    def __init__(self, message, path):
+        """
+        path is the list of step keys visited while looking for a step.
+        """
+        super(PrereqResolutionError, self).__init__(message)
+        self.path = path
+
+
 class SaveStepException(Exception):
     """
     Base class for an exception during the save method.
@@ -40,12 +214,119 @@ class SaveStepException(Exception):
     pass
 
 
+class _FrozenDict(dict):
+    """
+    A dict that refuses to be modified once it has been built.
+    """
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("%s is immutable" % type(self).__name__)
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+
+DEFAULT_NAVIGATION_OPTS = _FrozenDict({
+    'wizard_save': 0,
+    'wizard_continue': 1,
+    'wizard_previous': -1,
+    'wizard_next': 1,
+})
+
+
+def build_step_index(steps_tuple):
+    """
+    returns a tuple of the step keys in order (position -> key) and a dict
+    of step key to position (key -> position) for the given steps.
+    """
+    step_keys = tuple(key for key, _ in steps_tuple)
+    positions = {}
+    for position, key in enumerate(step_keys):
+        positions.setdefault(key, position)
+    return step_keys, _FrozenDict(positions)
+
+
+class WizardDefinition(object):
+    """
+    The static part of a wizard: the base url name, the steps and the
+    navigation options. A definition is never modified after it is built,
+    so it can be created once at import time and shared by every request
+    and thread, with a lightweight Wizard created from it per request.
+    """
+
+    def __init__(self, base_url_name, steps, navigation_opts=None,
+                 steps_cache_key=None, steps_cache_size=128, steps_cache_timeout=300):
+        """
+        takes the same arguments as the Wizard constructor. When steps is
+        not callable it is frozen into a tuple of tuples along with a
+        lookup dict of step key to step class and the step position index.
+
+        When steps is callable, steps_cache_key can be given a function of
+        the request (IE: returning the user's role or tenant) to cache the
+        steps it returns between requests. At most steps_cache_size step
+        lists are kept, each for steps_cache_timeout seconds.
+        """
+        attrs = {
+            'base_url_name': base_url_name,
+            'navigation_opts': _FrozenDict(navigation_opts or DEFAULT_NAVIGATION_OPTS),
+            'steps': None,
+            'step_index': None,
+            'steps_cache_key': steps_cache_key,
+            'steps_cache': None,
+        }
+        if callable(steps):
+            attrs['steps_callback'] = steps
+            if steps_cache_key is not None:
+                attrs['steps_cache'] = LRUCache(max_size=steps_cache_size, timeout=steps_cache_timeout)
+        else:
+            attrs['steps_callback'] = tuple((key, step) for key, step in steps)
+            attrs['steps'] = _FrozenDict(attrs['steps_callback'])
+            attrs['step_index'] = build_step_index(attrs['steps_callback'])
+        self.__dict__.update(attrs)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("WizardDefinition is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("WizardDefinition is immutable")
+
+    def create_wizard(self):
+        """
+        returns a new Wizard, holding only request state, for this definition
+        """
+        return Wizard.from_definition(self)
+
+    def get_steps(self, request=None):
+        """
+        returns the steps tuple, the step lookup dict and the step index to
+        use for the given request
+        """
+        if self.steps is not None:
+            return self.steps_callback, self.steps, self.step_index
+        if self.steps_cache is None:
+            return self._build_steps(request)
+
+        key = self.steps_cache_key(request)
+        steps = self.steps_cache.get(key)
+        if steps is None:
+            steps = self._build_steps(request)
+            self.steps_cache.set(key, steps)
+        return steps
+
+    def _build_steps(self, request):
+        steps_tuple = tuple((key, step) for key, step in self.steps_callback(request))
+        return steps_tuple, _FrozenDict(steps_tuple), build_step_index(steps_tuple)
+
+
 class Wizard(object):
     """
     Wires together multiple WizardStep objects and takes care
     of the navigation among WizardStep objects
     """
 
+    #: the most steps handle_prereq will move through looking for an available
+    #: step before giving up, None means there is no limit
+    max_prereq_hops = None
+
     def __init__(self, base_url_name, steps, navigation_opts=None):
         """
         a tuple of tuples of step key names, and step objects must be
@@ -56,6 +337,10 @@ class Wizard(object):
         self.do_redirect = False
         self.steps = None
         self.steps_tuple = None
+        self.step_keys = None
+        self.step_positions = None
+        self._indexed_steps_tuple = None
+        self._steps_request = None
         self.base_url_name = base_url_name
         self.url_args = None
         self.url_kwargs = None
@@ -64,12 +349,45 @@ class Wizard(object):
         self.request = None
         self._current_step = None
         self.template_args = None
-        self.navigation_opts = navigation_opts or {
-            'wizard_save': 0,
-            'wizard_continue': 1,
-            'wizard_previous': -1,
-            'wizard_next': 1,
-        }
+        self.definition = None
+        self.prereq_resolver = None
+        self.prereq_concurrency = None
+        self._prereq_results = {}
+        self._prereqs_resolved = False
+        self._navigation = None
+        self.prereq_path = None
+        self.phase_log = None
+        self.instrumentation = None
+        self.timings = None
+        self.state = None
+        self.state_commit = None
+        self.work = None
+        self.prefetch_cache = None
+        self.prefetch_timeout = None
+        self.render_cache = None
+        self.render_cache_timeout = None
+        self.inline_advance = False
+        self.renderers = (TemplateRenderer(), )
+        self.navigation_opts = navigation_opts or dict(DEFAULT_NAVIGATION_OPTS)
+
+    @classmethod
+    def from_definition(cls, definition):
+        """
+        creates a wizard for a single request from a shared WizardDefinition
+        """
+        wizard = cls(definition.base_url_name, definition.steps_callback, definition.navigation_opts)
+        wizard.definition = definition
+        return wizard
+
+    @property
+    def navigation(self):
+        """
+        A wizard.navigation.Navigation of every step, worked out (once per
+        request, and again after a save) the first time it is used.
+        """
+        if self._navigation is None:
+            self._navigation = Navigation(self)
+        return self._navigation
 
     @property
     def current_step_object(self):
@@ -103,40 +421,432 @@ class Wizard(object):
         self.url_args = args
         self.url_kwargs = kwargs
 
+    def set_instrumentation(self, sink=None, server_timing=False):
+        """
+        Turns on timing of the wizard's phases. After each handle_request the
+        timings attribute holds a wizard.instrumentation.Timings, which is also
+        passed to the sink's emit method (see wizard.instrumentation for some
+        sinks) and, with server_timing, added to the response as a
+        Server-Timing header.
+        """
+        self.instrumentation = (sink, server_timing)
+
+    def timed(self, phase, step_key=None):
+        """
+        returns a context manager timing the given phase when instrumentation
+        is on (and doing nothing when it is off)
+        """
+        if self.timings is None:
+            return NULL_TIMER
+        return self.timings.time(phase, step_key)
+
+    def set_state_store(self, store, on_commit=None):
+        """
+        A store (see wizard.storage) where steps can keep their data, keyed by
+        step key, until the wizard is finished. on_commit is called with a
+        dict of every step's data by commit_state.
+        """
+        self.state = store
+        self.state_commit = on_commit
+        self._check_work_store()
+
+    def commit_state(self):
+        """
+        Makes the writes queued in the unit of work and hands the data of
+        every step to the on_commit callback, all inside a single transaction,
+        and then empties the store. Returns what on_commit returns. Usually
+        called from the save method of the last step.
+        """
+        with transaction.commit_on_success():
+            if self.work is not None:
+                self.work.run()
+            data = self.state.all() if self.state is not None else {}
+            result = self.state_commit(data) if self.state_commit else None
+        if self.state is not None:
+            self.state.clear()
+        return result
+
+    def set_unit_of_work(self, work=None):
+        """
+        Lets steps queue their writes in wizard.work (a wizard.work.UnitOfWork)
+        instead of making them in save. With a state store the queued writes
+        are kept in the store between requests and made by commit_state, or
+        after the save of any step with a true flush_work attribute. Without a
+        store they are made at the end of every successful save. The store
+        must be able to pickle the writes, so CookieStateStore can't be used.
+        """
+        self.work = work if work is not None else UnitOfWork()
+        self._check_work_store()
+
+    def _check_work_store(self):
+        if self.work is None or self.state is None or getattr(self.state, 'keeps_work', True):
+            return
+        raise ValueError("%s can't keep the unit of work's queued writes, use a store that "
+            "pickles its data (IE: SessionStateStore)" % self.state.__class__.__name__)
+
+    def load_work(self):
+        if self.work is not None and self.state is not None:
+            self.work.operations = list(self.state.get(WORK_STATE_KEY, []))
+            self.work.modified = False
+
+    def save_work(self):
+        if self.work is not None and self.state is not None and self.work.modified:
+            if self.work.operations:
+                self.state.set(WORK_STATE_KEY, self.work.operations)
+            else:
+                self.state.delete(WORK_STATE_KEY)
+
+    def set_prereq_resolver(self, resolver):
+        """
+        A callable that works out the prereqs of many steps in one go. It is
+        called with the wizard and a list of step keys and must return a dict
+        of step key to None (prereq satisfied) or a PrereqMissing instance.
+        Steps it leaves out fall back to calling their own prereq method.
+        """
+        self.prereq_resolver = resolver
+
+    def set_prereq_concurrency(self, max_workers):
+        """
+        When the availability of many steps is needed (IE: get_available_steps)
+        the prereqs of steps with a true independent_prereq attribute are
+        worked out at the same time on a pool of max_workers threads. Their
+        prereqs must not depend on each other or on anything the request
+        thread does. They get their own database connection in each thread,
+        closed again after each prereq, and the messages of the PrereqMissing
+        they raise are added by the request thread.
+        """
+        self.prereq_concurrency = max_workers
+
+    def set_prefetch(self, cache='default', timeout=30):
+        """
+        After a successful save the wizard works out the next step and, when
+        that step has a prefetch method or a true prefetch_display attribute,
+        loads its data ahead of the redirect. The result is kept in the cache
+        (a cache alias or backend) for timeout seconds, per user, and used by
+        the GET that follows the redirect. The loading runs in the POST, before
+        the redirect is sent, so it moves the work from the GET to the POST
+        rather than hiding it.
+        """
+        self.prefetch_cache = get_cache(cache) if isinstance(cache, basestring) else cache
+        self.prefetch_timeout = timeout
+
+    def get_prefetch_key(self, request, step):
+        """
+        the cache key of the prefetched data of the given step for the user of
+        the request, or None when the user can't be told apart
+        """
+        owner = get_request_owner(request)
+        if owner is None:
+            return None
+        return 'wizard-prefetch:%s' % md5('%s:%s' % (owner, self.get_url(step))).hexdigest()
+
+    def prefetch_step(self, request, step):
+        """
+        Loads the data of the given step, with its prefetch method or (when it
+        has a true prefetch_display attribute) its display method, and keeps
+        it for the next GET. A failing prefetch is logged and ignored, the
+        GET will just load the data itself.
+        """
+        key = self.get_prefetch_key(request, step)
+        if key is None:
+            return
+        step_object = self.get_step_object_by_key(step)
+        if getattr(step_object, 'prefetch_display', False):
+            kind, method = 'display', step_object.display
+        elif hasattr(step_object, 'prefetch'):
+            kind, method = 'prefetch', step_object.prefetch
+        else:
+            return
+        try:
+            with self.timed('prefetch', step):
+                data = method()
+            self.prefetch_cache.set(key, (kind, data), self.prefetch_timeout)
+        except Exception:
+            logging.getLogger('wizard').exception("prefetching step %s failed", step)
+
+    def pop_prefetched(self, request, step):
+        """
+        returns the (kind, data) prefetched for the given step, or None, and
+        removes it from the cache so it is only used once
+        """
+        if self.prefetch_cache is None:
+            return None
+        key = self.get_prefetch_key(request, step)
+        if key is None:
+            return None
+        prefetched = self.prefetch_cache.get(key)
+        if prefetched is not None:
+            self.prefetch_cache.delete(key)
+        return prefetched
+
+    def set_render_cache(self, cache='default', timeout=300):
+        """
+        Keeps the rendered page of each step with a render_cache_key method in
+        the cache (a cache alias or backend) for timeout seconds, or the
+        step's render_cache_timeout. A GET finding the page in the cache
+        skips display and render. Saving the step, or any step listed in its
+        render_cache_dependencies, throws the user's cached pages away.
+        """
+        self.render_cache = get_cache(cache) if isinstance(cache, basestring) else cache
+        self.render_cache_timeout = timeout
+        signals.wizard_post_save.connect(invalidate_render_cache, dispatch_uid='wizard.invalidate_render_cache')
+
+    def get_render_generation_key(self, step, owner):
+        return 'wizard-render-generation:%s' % md5('%s:%s' % (owner, self.get_url(step))).hexdigest()
+
+    def bump_render_generation(self, step):
+        """
+        throws away the cached renders of the given step, for the current user
+        """
+        owner = get_request_owner(self.request)
+        if owner is not None:
+            self.render_cache.set(self.get_render_generation_key(step, owner), uuid.uuid4().hex)
+
+    def get_render_cache_key(self, step):
+        """
+        The cache key of the rendered page of the given step, made of the
+        user, the step's render_cache_key and the current generation of the
+        step and its render_cache_dependencies, or None when the page isn't
+        cached. Pages are never cached for users that can't be told apart.
+        """
+        step_object = self.get_step_object_by_key(step)
+        if self.render_cache is None or getattr(step_object, 'streaming', False):
+            return None
+        if not hasattr(step_object, 'render_cache_key'):
+            return None
+        owner = get_request_owner(self.request)
+        if owner is None:
+            return None
+        step_cache_key = step_object.render_cache_key()
+        if step_cache_key is None:
+            return None
+
+        dependencies = (step,) + tuple(getattr(step_object, 'render_cache_dependencies', ()))
+        generation_keys = [self.get_render_generation_key(key, owner) for key in dependencies]
+        generations = self.render_cache.get_many(generation_keys)
+        for generation_key in generation_keys:
+            if generation_key not in generations:
+                generations[generation_key] = uuid.uuid4().hex
+                self.render_cache.set(generation_key, generations[generation_key])
+        variant = (self.is_partial(self.request), self.get_renderer(self.request).media_type)
+        generation = ':'.join(generations[key] for key in generation_keys)
+        return 'wizard-render:%s' % md5('%s:%s:%s:%s:%s' % (
+            owner, self.get_url(step), step_cache_key, variant, generation)).hexdigest()
+
+    def set_renderers(self, *renderers):
+        """
+        The renderers (see wizard.renderers) the wizard can answer with. The
+        first is used unless the request's Accept header prefers the media
+        type of another one (IE: JSONRenderer for application/json).
+        """
+        self.renderers = renderers
+
+    def get_renderer(self, request):
+        if len(self.renderers) == 1:
+            return self.renderers[0]
+        return choose_renderer(self.renderers, request)
+
+    def set_inline_advance(self, enabled=True):
+        """
+        Answers successful ajax (or partial) POSTs with the next step's page,
+        rendered in the same request, instead of a redirect to it. The url of
+        that step is added to the response as an X-Wizard-Location header so
+        the client can update its history.
+        """
+        self.inline_advance = enabled
+
     def initialize_steps(self, request=None):
+        """
+        Works out the steps for the given request. This is only done once per
+        request, so a callable steps_callback isn't called again when
+        navigate initializes the steps.
+        """
+        if request is not None and request is self._steps_request:
+            return
+        self._steps_request = request
+
+        if self._uses_definition_steps():
+            self.steps_tuple, steps, (self.step_keys, self.step_positions) = self.definition.get_steps(request)
+            self.steps = steps.copy()
+            self._indexed_steps_tuple = self.steps_tuple
+            return
+
         if callable(self.steps_callback):
             self.steps_tuple = self.steps_callback(request)
         else:
             self.steps_tuple = self.steps_callback
         self.steps = dict(self.steps_tuple)
+        self.index_steps()
+
+    def index_steps(self):
+        """
+        builds the key -> position and position -> key lookups for the
+        current steps_tuple so navigation doesn't have to scan the steps.
+        """
+        self.step_keys, self.step_positions = build_step_index(self.steps_tuple)
+        self._indexed_steps_tuple = self.steps_tuple
+
+    def _check_step_index(self):
+        if self._indexed_steps_tuple is not self.steps_tuple:
+            self.index_steps()
+
+    def _uses_definition_steps(self):
+        return self.definition is not None and self.steps_callback is self.definition.steps_callback
 
     def handle_request(self, request, step=None):
         """
         Main dispatch method. Figures out which step to go to for the
         current request and which one to go to next.
         """
+        start = self.begin_request(request, step)
+
+        response = None
+        if not step:
+            response = self.redirect(self.get_step_key_by_position(0))
+        elif request.method == "POST":
+            response = self.post(request, step)
+        elif request.method == "GET":
+            response = self.get(request, step)
+
+        return self.finish_request(request, response, start)
+
+    def handle_batch_request(self, request):
+        """
+        Saves several steps in one POST. The body is json like
+        {"steps": [{"step": "StepOne", "data": {...}}, ...]}; each step in
+        turn gets its data through its set_data method, has its prereq
+        checked and is saved. It stops at the first step that fails and
+        answers with a json summary of the steps saved, the step that failed
+        (and why) and the step the wizard is at.
+        """
+        start = self.begin_request(request)
+        if request.method == "POST":
+            response = self.save_batch(request)
+        else:
+            response = http.HttpResponseNotAllowed(['POST'])
+        return self.finish_request(request, response, start)
+
+    def begin_request(self, request, step=None):
         self.request = request
         self._current_step = step
+        self.clear_prereq_results()
+        self.phase_log = [] if signals.wizard_request_finished.receivers else None
+        self.timings = Timings() if self.instrumentation else None
+        start = default_timer()
+        self._steps_request = None
+        self.load_work()
 
         self.initialize_steps(request)
+        return start
 
-        if not step:
-            return self.redirect(self.get_step_key_by_position(0))
+    def finish_request(self, request, response, start):
+        self.save_work()
+        if self.state is not None and response is not None:
+            self.state.persist(response)
+        if self.timings is not None:
+            self.finish_timings(response, default_timer() - start)
+        if self.phase_log is not None:
+            signals.wizard_request_finished.send(self, request=request, response=response, phases=self.phase_log)
+        return response
 
-        if request.method == "POST":
-            return self.post(request, step)
-        elif request.method == "GET":
-            return self.get(request, step)
+    def save_batch(self, request):
+        batch = self.parse_batch(request.body)
+        if batch is None:
+            return self.json_response({'error': 'invalid payload'}, status=400)
+        if not batch:
+            return self.json_response({'error': 'no steps'}, status=400)
+
+        saved = []
+        for step, data in batch:
+            failure = self.save_batch_step(step, data)
+            if failure is not None:
+                failure['step'] = step
+                current = step if step in self.step_positions else None
+                return self.json_response(self.batch_summary(saved, failure, current), status=400)
+            saved.append(step)
+
+        position = self.get_step_position(saved[-1])
+        current = self.handle_prereq(self.get_step_key_by_position(position + 1), 1)
+        return self.json_response(self.batch_summary(saved, None, current))
+
+    def parse_batch(self, body):
+        """
+        the (step key, data dict) pairs of a batch request's json body, or None
+        when it isn't a valid batch
+        """
+        try:
+            batch = [(item['step'], item.get('data', {})) for item in json.loads(body)['steps']]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+        for step, data in batch:
+            if not isinstance(step, basestring) or not isinstance(data, dict):
+                return None
+        return batch
+
+    def save_batch_step(self, step, data):
+        """
+        gives the step its data, checks its prereq and saves it, returning
+        None or a dict telling why it failed
+        """
+        if step not in self.step_positions:
+            return {'error': 'unknown step'}
+        step_object = self.get_step_object_by_key(step)
+        if not hasattr(step_object, 'set_data'):
+            return {'error': 'step does not take data'}
+
+        self._current_step = step
+        missing = self.check_prereq(step)
+        if missing is not None:
+            return {'error': 'prereq missing', 'message': missing.prereq_message, 'redirect': missing.step}
+        step_object.set_data(data)
+        try:
+            self.do_save(step)
+        except SaveStepException as exception:
+            message = force_unicode(exception, errors='replace')
+            return {'error': 'save failed', 'message': message or None}
+        return None
+
+    def batch_summary(self, saved, failed, current):
+        return {
+            'saved': saved,
+            'failed': failed,
+            'step': current,
+            'url': self.get_url(current) if current else None,
+        }
+
+    def json_response(self, data, status=200):
+        return http.HttpResponse(json.dumps(data), mimetype='application/json', status=status)
+
+    def finish_timings(self, response, total):
+        sink, server_timing = self.instrumentation
+        self.timings.total = total
+        if server_timing and response is not None:
+            response['Server-Timing'] = self.timings.server_timing()
+        if sink is not None:
+            sink.emit(self, self.timings)
+
+    def send_signal(self, name, step_key):
+        """
+        Sends the wizard_<name> signal for the given step. Nothing is done
+        when the signal has no receivers. While a wizard_request_finished
+        receiver is connected, the (name, step_key) pair is also added to
+        the phase_log that signal is sent with.
+        """
+        if self.phase_log is not None:
+            self.phase_log.append((name, step_key))
+        signal = getattr(signals, 'wizard_' + name)
+        if signal.receivers:
+            signal.send(self, step_key=step_key, request=self.request)
 
     def get_step_position(self, step):
         """
         lookup which position a given step key is in
         """
-        for order, (name, _) in enumerate(self.steps_tuple):
-            if name == step:
-                return order
-        else:
-            raise ValueError(step + " not found in wizard")
+        self._check_step_index()
+        try:
+            return self.step_positions[step]
+        except (KeyError, TypeError):
+            raise ValueError("%s not found in wizard" % (step,))
 
     def get_step_number(self, step):
         """gets the 1 based step position"""
@@ -146,15 +856,16 @@ class Wizard(object):
         return len(self.steps)
 
     def get_next_step_key(self, step):
-        return self.steps_tuple[self.get_step_position(step) + 1][0]
+        return self.step_keys[self.get_step_position(step) + 1]
 
     def get_step_key_by_position(self, position):
+        self._check_step_index()
         if position < 0:
-            return self.steps_tuple[0][0]
-        elif position < self.total_steps():
-            return self.steps_tuple[position][0]
+            return self.step_keys[0]
+        elif position < len(self.step_keys):
+            return self.step_keys[position]
         else:
-            return self.steps_tuple[-1][0]
+            return self.step_keys[-1]
 
     def get_steps(self):
         """
@@ -165,6 +876,17 @@ class Wizard(object):
         """
         return ((name, self.get_step_object_by_key(name)) for name, _ in self.steps_tuple)
 
+    def get_available_steps(self):
+        """
+        Like get_steps, but only includes the steps whose prereqs are satisfied.
+        """
+        self._check_step_index()
+        self.evaluate_prereqs(self.step_keys)
+        return ((name, step) for name, step in self.get_steps() if self.is_step_available(name))
+
+    def is_step_available(self, step):
+        return self.check_prereq(step) is None
+
     def get_step_object_by_key(self, key):
         step = self.steps.get(key)
         if not step:
@@ -181,13 +903,19 @@ class Wizard(object):
         return self.steps[key]
 
     def create_prereq(self, step):
+        """
+        wraps the step's prereq so it sends the pre and post prereq signals,
+        the step's own prereq is used as is when nothing is listening.
+        """
         orig_prereq = step.prereq
+        if self.phase_log is None and not (signals.wizard_pre_prereq.receivers or signals.wizard_post_prereq.receivers):
+            return orig_prereq
 
         @wraps(step.prereq)
         def wrapper_new_prereq():
-            signals.wizard_pre_prereq.send(self, step_key=step._key, request=self.request)
+            self.send_signal('pre_prereq', step._key)
             orig_prereq()
-            signals.wizard_post_prereq.send(self, step_key=step._key, request=self.request)
+            self.send_signal('post_prereq', step._key)
 
         return wrapper_new_prereq
 
@@ -209,49 +937,201 @@ class Wizard(object):
         return step
 
     def get_url(self, step):
-        if self.url_kwargs:
-            self.url_kwargs['step'] = step
-            return urlresolvers.reverse(self.base_url_name, kwargs=self.url_kwargs)
-        elif self.url_args:
-            self.url_args += (step, )
-            return urlresolvers.reverse(self.base_url_name, args=self.url_args)
-        else:
-            return urlresolvers.reverse(self.base_url_name, kwargs={'step':step})
+        with self.timed('url', step):
+            if self.url_kwargs:
+                return reverse(self.base_url_name, kwargs=dict(self.url_kwargs, step=step))
+            elif self.url_args:
+                return reverse(self.base_url_name, args=self.url_args + (step, ))
+            else:
+                return reverse(self.base_url_name, kwargs={'step':step})
 
     def redirect(self, step):
-        return http.HttpResponseRedirect(self.get_url(step))
+        url = self.get_url(step)
+        if self.request is not None and PARTIAL_PARAMETER in self.request.REQUEST:
+            url += '?%s=1' % PARTIAL_PARAMETER
+        return http.HttpResponseRedirect(url)
 
     def post(self, request, step):
         try:
-            signals.wizard_pre_save.send(self, step_key=step, request=self.request)
-            self.get_step_object_by_key(step).save()
-            signals.wizard_post_save.send(self, step_key=step, request=self.request)
+            self.do_save(step)
         except SaveStepException:
             return self.render(request, self.do_display(step), step)
         else:
-            return self.redirect(self.navigate(request, step))
+            next_step = self.navigate(request, step)
+            if self.inline_advance and (request.is_ajax() or self.is_partial(request)):
+                return self.advance_inline(request, next_step)
+            if self.prefetch_cache is not None:
+                self.prefetch_step(request, next_step)
+            return self.redirect(next_step)
 
-    def handle_prereq(self, next_step, direction=None):
+    def do_save(self, step):
+        self.send_signal('pre_save', step)
+        step_object = self.get_step_object_by_key(step)
+        self.save_step(step_object, step)
+        self.clear_prereq_results()
+        self.send_signal('post_save', step)
+
+    def advance_inline(self, request, step):
         """
-        This calls a step's prereq method and when a PrereqMissing exception
-        is raised this method will recursively find the next available step
-        to go to.
+        makes the given step the current one and answers with its page, with
+        the step's url in the X-Wizard-Location header
+        """
+        self._current_step = step
+        self._navigation = None
+        for step_object in self.steps.values():
+            if not inspect.isclass(step_object):
+                step_object._current_step = step
+        response = self.render_step(request, step)
+        response['X-Wizard-Location'] = self.get_url(step)
+        return response
+
+    def save_step(self, step_object, step):
+        """
+        calls the step's save, keeping track of the writes it queues in the
+        unit of work (when there is one) so they can be thrown away again
+        when it raises SaveStepException
         """
+        if self.work is None:
+            with self.timed('save', step):
+                step_object.save()
+            return
+
+        self.work.begin_step(step)
+        try:
+            with self.timed('save', step):
+                step_object.save()
+        except SaveStepException:
+            self.work.rollback_step()
+            raise
+        self.work.end_step()
+        if self.state is None or getattr(step_object, 'flush_work', False):
+            self.work.flush()
 
+    def check_prereq(self, step):
+        """
+        Runs a step's prereq method at most once per request. Returns None
+        when the prereq is satisfied or the PrereqMissing exception it raised.
+        When a prereq resolver is set it is consulted before the step itself.
+        """
+        if step not in self._prereq_results:
+            self.resolve_prereqs()
+        if step in self._prereq_results:
+            return self._prereq_results[step]
+
+        step_object = self.get_step_object_by_key(step)
         try:
-            self.get_step_object_by_key(next_step).prereq()
-            return next_step
+            with self.timed('prereq', step):
+                step_object.prereq()
+            result = None
         except PrereqMissing as exception:
+            result = exception
+        self._prereq_results[step] = result
+        return result
+
+    def defer_prereq_messages(self):
+        """
+        returns a context manager keeping back the messages of the prereqs
+        checked inside it; they are added when handle_prereq later goes
+        through the step outside of it
+        """
+        return DeferredPrereqMessages()
+
+    def clear_prereq_results(self):
+        """
+        Forgets the prereq outcomes remembered by check_prereq, so they are
+        evaluated again the next time they are needed.
+        """
+        self._prereq_results = {}
+        self._prereqs_resolved = False
+        self._navigation = None
+
+    def resolve_prereqs(self):
+        """
+        Hands every step whose prereq hasn't been checked yet to the prereq
+        resolver in a single call. Only does anything once per request (or
+        until the results are cleared) and only when a resolver is set.
+        Resolved prereqs don't send the prereq signals since no step's
+        prereq method is called.
+        """
+        if self.prereq_resolver is None or self._prereqs_resolved:
+            return
+        self._prereqs_resolved = True
+        self._check_step_index()
+        step_keys = [key for key in self.step_keys if key not in self._prereq_results]
+        if step_keys:
+            self._prereq_results.update(self.prereq_resolver(self, step_keys))
+
+    def evaluate_prereqs(self, step_keys):
+        """
+        Works out, ahead of time, the prereqs of the given steps that haven't
+        been checked yet. With prereq concurrency set, the prereqs of the steps
+        marked independent_prereq are run at the same time on a thread pool;
+        the results are remembered just as check_prereq would remember them, so
+        handle_prereq comes to the same answer as when they are run one by one.
+        """
+        self.resolve_prereqs()
+        if not self.prereq_concurrency:
+            return
+
+        independent = []
+        for key in step_keys:
+            if key not in self._prereq_results:
+                step_object = self.get_step_object_by_key(key)
+                if getattr(step_object, 'independent_prereq', False):
+                    independent.append((key, step_object))
+        if len(independent) < 2:
+            return
+
+        pool = get_thread_pool(self.prereq_concurrency)
+        results = pool.map(run_prereq, [obj for _, obj in independent])
+        for (key, _), (result, duration) in zip(independent, results):
+            if result is not None:
+                result.add_deferred_message()
+            self._prereq_results[key] = result
+            if self.timings is not None:
+                self.timings.record('prereq', key, duration)
+
+    def handle_prereq(self, next_step, direction=None):
+        """
+        This calls a step's prereq method and when a PrereqMissing exception
+        is raised this method will find the next available step to go to,
+        either by following the step given to the exception or, when moving
+        in a direction, by trying the following steps (turning around at the
+        end of the wizard).
+
+        The steps visited are kept in prereq_path. A PrereqResolutionError is
+        raised when a step is visited twice moving the same way, since that
+        means the prereqs form a cycle, or when more than max_prereq_hops
+        steps are visited.
+        """
+        direction = direction or 0
+        path = self.prereq_path = [next_step]
+        visited = set()
+
+        while True:
+            exception = self.check_prereq(next_step)
+            if exception is None:
+                return next_step
+            exception.add_deferred_message()
+
             self.do_redirect = True
 
+            if (next_step, direction) in visited:
+                raise PrereqResolutionError("missing prereqs form a cycle: %s" % (path,), path)
+            visited.add((next_step, direction))
+
             if direction:
                 pos = self.get_step_position(next_step)
                 new_step_key = self.get_step_key_by_position(pos + direction)
                 if new_step_key == next_step:
-                    return self.handle_prereq(new_step_key, direction * -1)
-                return self.handle_prereq(new_step_key, direction)
+                    direction *= -1
+                next_step = new_step_key
             else:
-                return self.handle_prereq(exception.step)
+                next_step = exception.step
+
+            path.append(next_step)
+            if self.max_prereq_hops is not None and len(path) - 1 > self.max_prereq_hops:
+                raise PrereqResolutionError("more than %d prereq hops: %s" % (self.max_prereq_hops, path), path)
 
     def navigate(self, request, step):
         """
@@ -273,40 +1153,243 @@ class Wizard(object):
         step = self.navigate(request, step)
         if self.do_redirect:
             return self.redirect(step)
+
+        etag, last_modified = self.get_validators(step)
+        if self.is_not_modified(request, etag, last_modified):
+            response = http.HttpResponseNotModified()
         else:
-            return self.render(request, self.do_display(step), step)
+            response = self.render_step(request, step)
+        if etag is not None or last_modified is not None:
+            self.add_validators(response, etag, last_modified)
+        return response
+
+    def render_step(self, request, step):
+        """
+        displays and renders the given step, or takes its page from the render
+        cache when it is there
+        """
+        cache_key = self.get_render_cache_key(step)
+        if cache_key is not None:
+            cached = self.render_cache.get(cache_key)
+            if cached is not None:
+                content, content_type = cached
+                response = http.HttpResponse(content, content_type=content_type)
+                if self.is_partial(request):
+                    self.add_navigation_headers(response, step)
+                if len(self.renderers) > 1:
+                    patch_vary_headers(response, ('Accept',))
+                return response
+
+        response = self.render(request, self.do_display(step, self.pop_prefetched(request, step)), step)
+        if cache_key is not None:
+            timeout = getattr(self.get_step_object_by_key(step), 'render_cache_timeout', self.render_cache_timeout)
+            self.render_cache.set(cache_key, (response.content, response['Content-Type']), timeout)
+        return response
+
+    def get_validators(self, step):
+        """
+        Returns the step's (etag, last_modified), from its optional etag and
+        last_modified methods, without calling display. etag returns a
+        string and last_modified a (UTC) datetime, or None.
+        """
+        step_object = self.get_step_object_by_key(step)
+        etag = step_object.etag() if hasattr(step_object, 'etag') else None
+        last_modified = step_object.last_modified() if hasattr(step_object, 'last_modified') else None
+        if last_modified is not None:
+            last_modified = timegm(last_modified.utctimetuple())
+        return etag, last_modified
+
+    def is_not_modified(self, request, etag, last_modified):
+        """
+        true when the request's If-None-Match or, without it, If-Modified-Since
+        header shows the client already has the current page
+        """
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            if etag is None:
+                return False
+            etags = parse_etags(if_none_match)
+            return '*' in etags or etag in etags
+
+        if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since and last_modified is not None:
+            since = parse_http_date_safe(if_modified_since)
+            return since is not None and last_modified <= since
+        return False
+
+    def add_validators(self, response, etag, last_modified):
+        """
+        adds the ETag and Last-Modified headers, and marks the response as
+        private and varying by cookie, since wizard pages belong to a user
+        """
+        if etag is not None:
+            response['ETag'] = quote_etag(etag)
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True)
+        patch_vary_headers(response, ('Cookie', 'X-Wizard-Partial'))
+        if len(self.renderers) > 1:
+            patch_vary_headers(response, ('Accept',))
+
+    def get_template(self, step):
+        """
+        Returns the template for the given step object. When the step has a
+        template_name, the template it returns is cached for the life of the
+        process, keyed by step class and template name, so it is only loaded
+        and parsed once. Setting WIZARD_TEMPLATE_AUTO_RELOAD (which defaults
+        to DEBUG) turns the cache off so template changes show up right away.
+        """
+        template_name = getattr(step, 'template_name', None)
+        if not template_name or getattr(settings, 'WIZARD_TEMPLATE_AUTO_RELOAD', settings.DEBUG):
+            return step.template()
+
+        key = (step.__class__, template_name)
+        try:
+            return _template_cache[key]
+        except KeyError:
+            template = _template_cache[key] = step.template()
+            return template
+
+    def is_partial(self, request):
+        """
+        true for requests asking for just the step's fragment, with an
+        X-Wizard-Partial: 1 header or a wizard_partial parameter
+        """
+        return request.META.get(PARTIAL_HEADER) in ('1', 'true') or PARTIAL_PARAMETER in request.REQUEST
+
+    def get_fragment_template(self, step):
+        """
+        Returns the template of the step's fragment, from its fragment_template
+        method or fragment_template_name, or None when it has neither. Like
+        get_template, templates loaded by name are cached.
+        """
+        if hasattr(step, 'fragment_template'):
+            return step.fragment_template()
+        template_name = getattr(step, 'fragment_template_name', None)
+        if not template_name:
+            return None
+        if getattr(settings, 'WIZARD_TEMPLATE_AUTO_RELOAD', settings.DEBUG):
+            return loader.get_template(template_name)
+
+        key = ('fragment', template_name)
+        try:
+            return _template_cache[key]
+        except KeyError:
+            template = _template_cache[key] = loader.get_template(template_name)
+            return template
+
+    def render_fragment(self, request, data, step):
+        """
+        Renders the step's fragment template (or its template when it has no
+        fragment) with the data and a csrf token but without running the
+        context processors. The step's place in the wizard is added to the
+        response as X-Wizard-* headers for the client to update the rest of
+        the page with.
+        """
+        step_key, step = step, self.get_step_object_by_key(step)
+        with self.timed('render', step_key):
+            template = self.get_fragment_template(step) or self.get_template(step)
+            context = Context(data)
+            context.update(csrf(request))
+            content = template.render(context)
+        response = http.HttpResponse(content, mimetype=getattr(step, 'mimetype', None))
+        self.add_navigation_headers(response, step_key)
+        return response
+
+    def add_navigation_headers(self, response, step):
+        response['X-Wizard-Step'] = step
+        response['X-Wizard-Step-Number'] = str(self.get_step_number(step))
+        response['X-Wizard-Total-Steps'] = str(self.total_steps())
+        for header, direction in (('X-Wizard-Next-Url', 1), ('X-Wizard-Prev-Url', -1)):
+            url = self.move_step_direction(direction, step)
+            if url:
+                response[header] = url
 
     def render(self, request, data, step):
-        step = self.get_step_object_by_key(step)
-        template = step.template()
+        response = self.get_renderer(request).render(self, request, data, step)
+        if len(self.renderers) > 1:
+            patch_vary_headers(response, ('Accept',))
+        return response
+
+    def render_template(self, request, data, step):
+        if self.is_partial(request):
+            return self.render_fragment(request, data, step)
+        step_key, step = step, self.get_step_object_by_key(step)
         mimetype = getattr(step, 'mimetype', None)
-        return http.HttpResponse(template.render(RequestContext(request, data)), mimetype=mimetype)
+        if getattr(step, 'streaming', False):
+            return http.HttpResponse(self.stream(request, data, step_key), mimetype=mimetype)
+        with self.timed('render', step_key):
+            template = self.get_template(step)
+            content = template.render(RequestContext(request, data))
+        return http.HttpResponse(content, mimetype=mimetype)
 
-    def do_display(self, step):
+    def stream(self, request, data, step):
+        """
+        Returns an iterator of the page of a step with a true streaming
+        attribute: the step's own stream method, called with the template
+        context, or failing that the step's template split between its top
+        level nodes. The page is only rendered while the response is sent,
+        so it isn't part of the render timing.
+        """
         step_object = self.get_step_object_by_key(step)
-        signals.wizard_pre_display.send(self, step_key=step, request=self.request)
-        data = step_object.display() or {}
-        signals.wizard_post_display.send(self, step_key=step, request=self.request)
+        context = RequestContext(request, data)
+        if hasattr(step_object, 'stream'):
+            return step_object.stream(context)
+        with self.timed('render', step):
+            template = self.get_template(step_object)
+        return stream_template(template, context)
+
+    def do_display(self, step, prefetched=None):
+        """
+        gets the data for the template from the step's display method. With
+        data prefetched by prefetch_step, a prefetched display result is used
+        instead of calling display, and the result of a step's prefetch method
+        is made available to display as the step's prefetched attribute.
+        """
+        step_object = self.get_step_object_by_key(step)
+        self.send_signal('pre_display', step)
+        with self.timed('display', step):
+            kind, prefetched_data = prefetched or (None, None)
+            if kind == 'display':
+                data = prefetched_data or {}
+            else:
+                if kind == 'prefetch':
+                    step_object.prefetched = prefetched_data
+                data = step_object.display() or {}
+        self.send_signal('post_display', step)
         return self.add_wizard_data_to_template(data, step)
 
     def add_wizard_data_to_template(self, data, step):
         """
         make some of the internals of the wizard available from the templates to allow
-        dynamic building of navigation
-        """
-        if self.template_args:
-            for key, value in self.template_args.items():
-                data[key] = value
-        data['step_key'] = step
-        data['step'] = self.get_step_object_by_key(step)
-        data['wizard'] = self
-        return data
-
-    def move_step_direction(self, direction):
-        position = self.get_step_position(self._current_step)
+        dynamic building of navigation. Nothing is copied: the template looks through
+        the wizard's entries (step_key, step, wizard and navigation, only worked out
+        when used), then the common template args and then the step's data, which is
+        where anything set on the returned dict goes.
+        """
+        wizard_data = LazyDict({
+            'step_key': lambda: step,
+            'step': lambda: self.get_step_object_by_key(step),
+            'wizard': lambda: self,
+            'navigation': lambda: self.navigation,
+        })
+        return LayeredDict((wizard_data, self.template_args or {}, data), writable=data)
+
+    def get_step_in_direction(self, direction, from_step=None):
+        """
+        the key of the step moving in the given direction from the given (or
+        current) step ends up at, or None when it stays where it is
+        """
+        from_step = from_step or self._current_step
+        position = self.get_step_position(from_step)
         next_step = self.get_step_key_by_position(position + direction)
         step = self.handle_prereq(next_step, direction)
-        if step != self._current_step:
+        if step != from_step:
+            return step
+
+    def move_step_direction(self, direction, from_step=None):
+        step = self.get_step_in_direction(direction, from_step)
+        if step is not None:
             return self.get_url(step)
 
     def next_step_url(self):
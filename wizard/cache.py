@@ -0,0 +1,55 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A small thread safe cache holding at most max_size items. When it is
+    full, the least recently used item is thrown away to make room. When a
+    timeout (in seconds) is given, items expire that long after being set.
+    """
+
+    def __init__(self, max_size=128, timeout=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        try:
+            expires, _ = self._items[key]
+        except KeyError:
+            return False
+        return expires is None or expires > time.time()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._items.pop(key)
+            except KeyError:
+                return default
+            if expires is not None and expires <= time.time():
+                return default
+            self._items[key] = (expires, value)
+            return value
+
+    def set(self, key, value):
+        expires = None if self.timeout is None else time.time() + self.timeout
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (expires, value)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,21 @@
+"""
+Thread pools for working out independent prereqs at the same time.
+"""
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_thread_pool(size):
+    """
+    returns a process wide pool of the given number of threads, creating
+    it the first time it is asked for
+    """
+    with _pools_lock:
+        pool = _pools.get(size)
+        if pool is None:
+            pool = _pools[size] = ThreadPool(size)
+        return pool
@@ -0,0 +1,82 @@
+"""
+The data the wizard hands to a step's template.
+
+Rather than copying the common template args and the wizard's own entries
+into every step's display data, the template gets a LayeredDict looking
+through a LazyDict of the wizard's entries (only worked out when the
+template uses them), the common template args, which are shared by every
+request and never written to, and the step's data.
+"""
+from UserDict import DictMixin
+
+
+class LazyDict(DictMixin):
+    """
+    A read only dict of key to a callable returning the value, which is
+    called the first time the key is looked up.
+    """
+
+    def __init__(self, factories):
+        self.factories = factories
+        self.values = {}
+
+    def __getitem__(self, key):
+        if key not in self.values:
+            self.values[key] = self.factories[key]()
+        return self.values[key]
+
+    def __contains__(self, key):
+        return key in self.factories
+
+    def __iter__(self):
+        return iter(self.factories)
+
+    def keys(self):
+        return list(self.factories)
+
+    def __repr__(self):
+        return '<LazyDict %r>' % sorted(self.factories)
+
+
+class LayeredDict(DictMixin):
+    """
+    Looks keys up in each of its layers in turn, the first layer winning.
+    Writes and deletes only touch the writable layer (the first one unless
+    another is given), so they don't show for keys an earlier layer has.
+    """
+
+    def __init__(self, layers, writable=None):
+        self.layers = tuple(layers)
+        self.writable = self.layers[0] if writable is None else writable
+
+    def __getitem__(self, key):
+        for layer in self.layers:
+            if key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self.writable[key] = value
+
+    def __delitem__(self, key):
+        del self.writable[key]
+
+    def __contains__(self, key):
+        for layer in self.layers:
+            if key in layer:
+                return True
+        return False
+
+    def __iter__(self):
+        seen = set()
+        for layer in self.layers:
+            for key in layer:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def keys(self):
+        return list(self.__iter__())
+
+    def __repr__(self):
+        return '<LayeredDict %r>' % (self.layers, )
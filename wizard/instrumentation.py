@@ -0,0 +1,120 @@
+"""
+Opt-in timing of the work a wizard does while handling a request.
+
+Turn it on with Wizard.set_instrumentation. After handle_request the
+wizard's timings attribute holds the wall time and number of calls of each
+phase (prereq, save, display, render and url), overall and per step key.
+"""
+import logging
+import socket
+from timeit import default_timer
+
+
+class _Timer(object):
+
+    def __init__(self, timings, phase, step_key):
+        self.timings = timings
+        self.phase = phase
+        self.step_key = step_key
+        self.start = None
+
+    def __enter__(self):
+        self.start = default_timer()
+
+    def __exit__(self, *exc_info):
+        self.timings.record(self.phase, self.step_key, default_timer() - self.start)
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+NULL_TIMER = _NullTimer()
+
+
+class Timings(object):
+    """
+    Wall time (in seconds) and call counts per phase and per (phase, step key).
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.steps = {}
+        self.total = 0.0
+
+    def time(self, phase, step_key=None):
+        """
+        returns a context manager recording the time spent inside it
+        """
+        return _Timer(self, phase, step_key)
+
+    def record(self, phase, step_key, duration):
+        for stats, key in ((self.phases, phase), (self.steps, (phase, step_key))):
+            count, total = stats.get(key, (0, 0.0))
+            stats[key] = (count + 1, total + duration)
+
+    def server_timing(self):
+        """
+        the timings formatted as the value of a Server-Timing header
+        """
+        metrics = ["%s;dur=%.3f" % (phase, total * 1000) for phase, (_, total) in sorted(self.phases.items())]
+        metrics.append("total;dur=%.3f" % (self.total * 1000))
+        return ', '.join(metrics)
+
+
+class LoggingSink(object):
+    """
+    Logs one line with the phase timings of each request.
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('wizard.instrumentation')
+        self.level = level
+
+    def emit(self, wizard, timings):
+        self.logger.log(self.level, "wizard %s step %s: %s",
+            wizard.base_url_name, wizard._current_step, timings.server_timing())
+
+
+class MemorySink(object):
+    """
+    Keeps the timings of every request in a list, which is handy for tests.
+    """
+
+    def __init__(self):
+        self.timings = []
+
+    def emit(self, wizard, timings):
+        self.timings.append(timings)
+
+
+class StatsdSink(object):
+    """
+    Sends the timings to a statsd style daemon over UDP. Sending is fire and
+    forget, errors are ignored so a missing daemon never breaks a request.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='wizard'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def get_lines(self, timings):
+        lines = ["%s.total:%.3f|ms" % (self.prefix, timings.total * 1000)]
+        for phase, (count, total) in sorted(timings.phases.items()):
+            lines.append("%s.%s:%.3f|ms" % (self.prefix, phase, total * 1000))
+            lines.append("%s.%s.calls:%d|c" % (self.prefix, phase, count))
+        for (phase, step_key), (_, total) in sorted(timings.steps.items()):
+            if step_key is not None:
+                lines.append("%s.%s.%s:%.3f|ms" % (self.prefix, phase, step_key, total * 1000))
+        return lines
+
+    def emit(self, wizard, timings):
+        try:
+            self.socket.sendto('\n'.join(self.get_lines(timings)), self.address)
+        except socket.error:
+            pass
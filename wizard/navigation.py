@@ -0,0 +1,116 @@
+"""
+A per request model of the wizard's steps for building navigation menus.
+
+Templates get it as ``navigation``; it is only worked out the first time it
+is used, in a single pass over the steps. Each prereq is checked once and
+each url reversed once, however many times the template looks at them::
+
+    {% for item in navigation %}
+        {% if item.reachable %}<a href="{{ item.url }}">{{ item.number }}</a>{% endif %}
+    {% endfor %}
+    {% if navigation.next %}<a href="{{ navigation.next.url }}">next</a>{% endif %}
+"""
+
+
+class NavigationItem(object):
+    """
+    One step of the wizard: its key, 1 based number and url, whether its
+    prereq is satisfied (reachable), whether it has been completed and
+    whether it is the step being shown (current).
+    """
+
+    def __init__(self, key, number, url, reachable, completed, current):
+        self.key = key
+        self.number = number
+        self.url = url
+        self.reachable = reachable
+        self.completed = completed
+        self.current = current
+
+    def __repr__(self):
+        return '<NavigationItem %s>' % self.key
+
+
+class Navigation(object):
+    """
+    The steps of a wizard as NavigationItems, along with the items the
+    wizard's next and previous buttons go to (or None).
+
+    A step is completed when its is_complete method returns true or, for
+    steps without one, when the wizard's state store has data for it.
+    """
+
+    def __init__(self, wizard):
+        self.wizard = wizard
+        self._items = None
+        self._next = None
+        self._prev = None
+
+    @property
+    def items(self):
+        if self._items is None:
+            self._items = self.build()
+        return self._items
+
+    def build(self):
+        wizard = self.wizard
+        if wizard.steps is None:
+            wizard.initialize_steps()
+        wizard._check_step_index()
+        step_keys = wizard.step_keys
+
+        # showing the menu doesn't send the user anywhere, so the messages of
+        # missing prereqs are only added if the wizard goes through the step
+        with wizard.defer_prereq_messages():
+            wizard.evaluate_prereqs(step_keys)
+
+            items = []
+            for number, key in enumerate(step_keys, 1):
+                items.append(NavigationItem(
+                    key=key,
+                    number=number,
+                    url=wizard.get_url(key),
+                    reachable=wizard.check_prereq(key) is None,
+                    completed=self.is_completed(key),
+                    current=key == wizard._current_step,
+                ))
+
+            if wizard._current_step in wizard.step_positions:
+                # the buttons' prereq walks only use the prereqs checked above
+                do_redirect, prereq_path = wizard.do_redirect, wizard.prereq_path
+                by_key = dict((item.key, item) for item in items)
+                self._next = by_key.get(wizard.get_step_in_direction(1))
+                self._prev = by_key.get(wizard.get_step_in_direction(-1))
+                wizard.do_redirect, wizard.prereq_path = do_redirect, prereq_path
+        return items
+
+    def is_completed(self, key):
+        step_object = self.wizard.get_step_object_by_key(key)
+        if hasattr(step_object, 'is_complete'):
+            return bool(step_object.is_complete())
+        return self.wizard.state is not None and key in self.wizard.state
+
+    @property
+    def current(self):
+        for item in self.items:
+            if item.current:
+                return item
+
+    @property
+    def next(self):
+        self.items
+        return self._next
+
+    @property
+    def prev(self):
+        self.items
+        return self._prev
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
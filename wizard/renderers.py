@@ -0,0 +1,83 @@
+"""
+Renderers turning the data of a step's display into a response.
+
+Set them with Wizard.set_renderers; the first one is used unless the
+request's Accept header prefers the media type of another one.
+"""
+import json
+
+from django import http
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+def parse_accept(header):
+    """
+    the media types of an Accept header, most preferred first
+    """
+    media_types = []
+    for position, item in enumerate(header.split(',')):
+        parts = item.strip().split(';')
+        quality = 1.0
+        for param in parts[1:]:
+            name, sep, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if parts[0] and quality > 0:
+            media_types.append((-quality, position, parts[0].strip().lower()))
+    return [media_type for _, _, media_type in sorted(media_types)]
+
+
+def choose_renderer(renderers, request):
+    """
+    the first renderer of the most preferred media type the request accepts,
+    or the first renderer when it accepts anything (or sends no Accept)
+    """
+    for media_type in parse_accept(request.META.get('HTTP_ACCEPT') or '*/*'):
+        if media_type == '*/*':
+            return renderers[0]
+        for renderer in renderers:
+            if renderer.media_type == media_type or (
+                    media_type.endswith('/*') and renderer.media_type.startswith(media_type[:-1])):
+                return renderer
+    return renderers[0]
+
+
+class TemplateRenderer(object):
+    """
+    Renders the step's template, the way the wizard always has.
+    """
+    media_type = 'text/html'
+
+    def render(self, wizard, request, data, step):
+        return wizard.render_template(request, data, step)
+
+
+class JSONRenderer(object):
+    """
+    Serves the step's display data as json, along with where the step is in
+    the wizard, without loading templates or running context processors.
+    The wizard's entries and the common template args are left out.
+    Override encode to use another encoder.
+    """
+    media_type = 'application/json'
+
+    def get_content(self, wizard, data, step):
+        return {
+            'step': step,
+            'step_number': wizard.get_step_number(step),
+            'total_steps': wizard.total_steps(),
+            'next_url': wizard.move_step_direction(1, step),
+            'prev_url': wizard.move_step_direction(-1, step),
+            'data': dict(getattr(data, 'writable', data)),
+        }
+
+    def encode(self, content):
+        return json.dumps(content, cls=DjangoJSONEncoder, separators=(',', ':'))
+
+    def render(self, wizard, request, data, step):
+        with wizard.timed('render', step):
+            content = self.encode(self.get_content(wizard, data, step))
+        return http.HttpResponse(content, mimetype=self.media_type)
@@ -6,3 +6,4 @@ wizard_pre_display = dispatch.Signal(providing_args=['step_key', 'request'])
 wizard_post_display = dispatch.Signal(providing_args=['step_key', 'request'])
 wizard_post_prereq = dispatch.Signal(providing_args=['step_key', 'request'])
 wizard_pre_prereq = dispatch.Signal(providing_args=['step_key', 'request'])
+wizard_request_finished = dispatch.Signal(providing_args=['request', 'response', 'phases'])
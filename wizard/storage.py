@@ -0,0 +1,155 @@
+"""
+State stores keep the data of each step between requests so steps don't
+have to write to the database until the wizard is finished.
+
+A step stashes its data with ``self._wizard.state.set(self._key, data)``
+and reads it back (IE: in display) with ``self._wizard.state.get(self._key)``.
+Changes are written out once at the end of the request.
+"""
+import json
+
+from django.core.cache import get_cache
+
+
+class BaseStateStore(object):
+    """
+    Holds a dict of step key to step data. Subclasses define how the whole
+    dict is loaded and saved. Stores that pickle the data can also keep the
+    writes queued in a unit of work (see wizard.work) between requests.
+    """
+    keeps_work = True
+
+    def __init__(self, prefix='wizard'):
+        self.prefix = prefix
+        self.modified = False
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self.load() or {}
+        return self._data
+
+    def __contains__(self, step_key):
+        return step_key in self.data
+
+    def get(self, step_key, default=None):
+        return self.data.get(step_key, default)
+
+    def set(self, step_key, value):
+        self.data[step_key] = value
+        self.modified = True
+
+    def delete(self, step_key):
+        if step_key in self.data:
+            del self.data[step_key]
+            self.modified = True
+
+    def all(self):
+        """
+        a copy of the data of every step, leaving out the wizard's own
+        entries (their keys start with two underscores)
+        """
+        return dict((key, value) for key, value in self.data.items()
+            if not (isinstance(key, basestring) and key.startswith('__')))
+
+    def clear(self):
+        self._data = {}
+        self.modified = True
+
+    def persist(self, response):
+        """
+        called by the wizard at the end of each request to save any changes
+        """
+        if self.modified:
+            self.save(self.data, response)
+            self.modified = False
+
+    def load(self):
+        raise NotImplementedError
+
+    def save(self, data, response):
+        raise NotImplementedError
+
+
+class MemoryStateStore(BaseStateStore):
+    """
+    Keeps the data on the store itself, mostly useful for tests.
+    """
+
+    def __init__(self, data=None, prefix='wizard'):
+        super(MemoryStateStore, self).__init__(prefix)
+        self.saved = dict(data or {})
+
+    def load(self):
+        return dict(self.saved)
+
+    def save(self, data, response):
+        self.saved = dict(data)
+
+
+class SessionStateStore(BaseStateStore):
+    """
+    Keeps the data in django's session, under the store's prefix.
+    """
+
+    def __init__(self, request, prefix='wizard'):
+        super(SessionStateStore, self).__init__(prefix)
+        self.session = request.session
+
+    def load(self):
+        return dict(self.session.get(self.prefix, {}))
+
+    def save(self, data, response):
+        if data:
+            self.session[self.prefix] = data
+        else:
+            self.session.pop(self.prefix, None)
+        self.session.modified = True
+
+
+class CacheStateStore(BaseStateStore):
+    """
+    Keeps the data in one of django's cache backends under the given key,
+    which should identify the user (IE: their session key).
+    """
+
+    def __init__(self, key, cache='default', timeout=None, prefix='wizard'):
+        super(CacheStateStore, self).__init__(prefix)
+        self.key = '%s:%s' % (prefix, key)
+        self.cache = get_cache(cache) if isinstance(cache, basestring) else cache
+        self.timeout = timeout
+
+    def load(self):
+        return self.cache.get(self.key)
+
+    def save(self, data, response):
+        if data:
+            self.cache.set(self.key, data, self.timeout)
+        else:
+            self.cache.delete(self.key)
+
+
+class CookieStateStore(BaseStateStore):
+    """
+    Keeps the data, as JSON, in a signed cookie named after the prefix. The
+    data must be JSON serializable and small enough to fit in a cookie, so
+    it can't keep a unit of work.
+    """
+    keeps_work = False
+
+    def __init__(self, request, prefix='wizard', max_age=None):
+        super(CookieStateStore, self).__init__(prefix)
+        self.request = request
+        self.max_age = max_age
+
+    def load(self):
+        value = self.request.get_signed_cookie(self.prefix, default=None, salt=self.prefix)
+        return json.loads(value) if value else None
+
+    def save(self, data, response):
+        if data:
+            response.set_signed_cookie(self.prefix, json.dumps(data, separators=(',', ':')),
+                salt=self.prefix, max_age=self.max_age)
+        else:
+            response.delete_cookie(self.prefix)
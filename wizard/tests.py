@@ -1,15 +1,32 @@
 from django.dispatch import Signal
 import mock
 import copy
+import datetime
+import decimal
+import json
+import logging
+import socket
+import sys
+import threading
 
 from django import test
 from django import http
 from django.core import urlresolvers
-from django.template import Template
+from django.core.cache import get_cache
+from django.template import Context, Template
 from django.contrib import messages
 from django.contrib.auth.models import User
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
 
 import wizard
+from wizard.cache import LRUCache
+from wizard import context
+from wizard import instrumentation
+from wizard import renderers
+from wizard import storage
+from wizard.work import UnitOfWork
+from wizard.concurrency import get_thread_pool
 
 class SampleStep(object):
     def display(self):
@@ -106,6 +123,14 @@ class TestWizard(test.TestCase):
         for attr_name, receivers in self._signals.items():
             getattr(wizard.signals, attr_name).receivers = receivers
 
+    def listen_to(self, signal):
+        """
+        the wizard only sends signals that have receivers, so connect one
+        """
+        receiver = mock.Mock()
+        signal.connect(receiver, weak=False)
+        return receiver
+
     def test_should_instantiate_step_classes_as_needed(self):
         """
         make sure that the wizard instantiates only the classes that are requested
@@ -547,6 +572,36 @@ class TestWizard(test.TestCase):
         self.wizard.initialize_steps(request)
         self.wizard.steps_callback.assert_called_once_with(request)
 
+    def test_calls_steps_callback_once_per_get_request(self):
+        self.wizard.steps_callback = mock.Mock(return_value=self.steps)
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.wizard.steps_callback.assert_called_once_with(self.mock_request)
+
+    def test_calls_steps_callback_once_per_post_request(self):
+        self.mock_request.method = 'POST'
+        self.mock_request.REQUEST = {'wizard_continue': True}
+        self.wizard.steps_callback = mock.Mock(return_value=self.steps)
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.wizard.steps_callback.assert_called_once_with(self.mock_request)
+
+    def test_calls_steps_callback_again_for_next_request(self):
+        self.wizard.steps_callback = mock.Mock(return_value=self.steps)
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.assertEqual(2, self.wizard.steps_callback.call_count)
+
+    def test_initialize_steps_keeps_steps_for_same_request(self):
+        self.wizard.initialize_steps(self.mock_request)
+        step = self.wizard.get_step_object_by_key('first')
+        self.wizard.initialize_steps(self.mock_request)
+        self.assertEqual(step, self.wizard.steps['first'])
+
+    def test_initialize_steps_without_request_always_rebuilds_steps(self):
+        self.wizard.steps_callback = mock.Mock(return_value=self.steps)
+        self.wizard.initialize_steps()
+        self.wizard.initialize_steps()
+        self.assertEqual(2, self.wizard.steps_callback.call_count)
+
     def test_should_set_steps_tuple_as_steps_callback_if_not_callable(self):
         steps_callback = self.steps
         self.wizard.steps_callback = steps_callback
@@ -558,6 +613,38 @@ class TestWizard(test.TestCase):
         self.wizard.initialize_steps()
         self.assertEqual(dict(self.steps), self.wizard.steps)
 
+    def test_initialize_steps_builds_step_index(self):
+        self.wizard.initialize_steps()
+        self.assertEqual(('first', 'second', 'third', 'fourth', 'fifth'), self.wizard.step_keys)
+        self.assertEqual(dict(first=0, second=1, third=2, fourth=3, fifth=4), self.wizard.step_positions)
+
+    def test_initialize_steps_builds_step_index_for_callable_steps_callback(self):
+        self.wizard.steps_callback = mock.Mock(return_value=self.steps[:2])
+        self.wizard.initialize_steps(self.mock_request)
+        self.assertEqual(('first', 'second'), self.wizard.step_keys)
+        self.assertEqual(dict(first=0, second=1), self.wizard.step_positions)
+
+    def test_get_step_position_does_not_scan_steps(self):
+        self.wizard.initialize_steps()
+        self.wizard.steps_tuple = mock.MagicMock(wraps=self.wizard.steps_tuple)
+        self.wizard._indexed_steps_tuple = self.wizard.steps_tuple
+        self.assertEqual(3, self.wizard.get_step_position('fourth'))
+        self.assertFalse(self.wizard.steps_tuple.__iter__.called)
+
+    def test_get_step_position_reindexes_when_steps_tuple_is_replaced(self):
+        self.wizard.initialize_steps()
+        self.wizard.steps_tuple = (('other', TestStepOne), ('first', TestStepTwo))
+        self.assertEqual(1, self.wizard.get_step_position('first'))
+
+    def test_get_step_position_raises_value_error_for_unknown_step(self):
+        self.wizard.initialize_steps()
+        self.assertRaises(ValueError, self.wizard.get_step_position, 'xxx')
+
+    def test_get_step_position_returns_first_position_of_duplicate_key(self):
+        self.wizard.steps_callback = [('first', TestStepOne), ('first', TestStepTwo)]
+        self.wizard.initialize_steps()
+        self.assertEqual(0, self.wizard.get_step_position('first'))
+
     def test_should_reverse_direction_to_find_step_without_missing_prereq(self):
         self.steps[1] = ('second', TestStepOne)
         self.steps[2] = ('third', get_class_with_missing_prereq('first'))
@@ -613,8 +700,22 @@ class TestWizard(test.TestCase):
         wiz.handle_request(self.mock_request, 'fifth')
         self.assertEqual(wiz.next_step_url(), None)
 
+    def test_get_url_does_not_grow_positional_url_args(self):
+        wiz = wizard.Wizard('test:test3', self.steps)
+        wiz.set_redirect_args(1234, 'asdf')
+        self.assertEqual('/test/1234/asdf/second', wiz.get_url('second'))
+        self.assertEqual('/test/1234/asdf/third', wiz.get_url('third'))
+        self.assertEqual((1234, 'asdf'), wiz.url_args)
+
+    def test_get_url_does_not_change_url_kwargs(self):
+        wiz = wizard.Wizard('test:test2', self.steps)
+        wiz.set_redirect_args(asdf=1234)
+        self.assertEqual('/test/1234/second', wiz.get_url('second'))
+        self.assertEqual({'asdf': 1234}, wiz.url_kwargs)
+
     @mock.patch('wizard.signals.wizard_pre_save.send')
     def test_sends_pre_save_signal_in_post(self, send_presave):
+        self.listen_to(wizard.signals.wizard_pre_save)
         wiz = wizard.Wizard('test:test3', self.steps)
         wiz.set_redirect_args(1234, 'asdf')
         self.mock_request.method = 'POST'
@@ -624,6 +725,7 @@ class TestWizard(test.TestCase):
 
     @mock.patch('wizard.signals.wizard_post_save.send')
     def test_sends_post_save_signal_in_post(self, send_postsave):
+        self.listen_to(wizard.signals.wizard_post_save)
         wiz = wizard.Wizard('test:test3', self.steps)
         wiz.set_redirect_args(1234, 'asdf')
         self.mock_request.method = 'POST'
@@ -634,6 +736,7 @@ class TestWizard(test.TestCase):
     @mock.patch.object(TestStepOne, 'save', mock.Mock(side_effect=wizard.SaveStepException))
     @mock.patch('wizard.signals.wizard_post_save.send')
     def test_does_not_send_post_save_signal_in_post_on_save_step_exception(self, send_postsave):
+        self.listen_to(wizard.signals.wizard_post_save)
         wiz = wizard.Wizard('test:test3', self.steps)
         wiz.set_redirect_args(1234, 'asdf')
         self.mock_request.method = 'POST'
@@ -643,18 +746,21 @@ class TestWizard(test.TestCase):
 
     @mock.patch('wizard.signals.wizard_pre_display.send')
     def test_sends_pre_display_signal_in_do_display(self, send_predisplay):
+        self.listen_to(wizard.signals.wizard_pre_display)
         wiz = wizard.Wizard('test:test3', self.steps)
         wiz.handle_request(self.mock_request, 'first')
         send_predisplay.assert_called_once_with(wiz, step_key='first', request=self.mock_request)
 
     @mock.patch('wizard.signals.wizard_post_display.send')
     def test_sends_post_display_signal_in_do_display(self, send_postdisplay):
+        self.listen_to(wizard.signals.wizard_post_display)
         wiz = wizard.Wizard('test:test3', self.steps)
         wiz.handle_request(self.mock_request, 'first')
         send_postdisplay.assert_called_once_with(wiz, step_key='first', request=self.mock_request)
 
     @mock.patch('wizard.signals.wizard_post_prereq.send')
     def test_sends_post_prereq_signal_in_prereq(self, send_post_prereq):
+        self.listen_to(wizard.signals.wizard_post_prereq)
         wiz = wizard.Wizard('test:test3', self.steps)
         wiz.request = self.mock_request
         wiz.steps = dict(self.steps)
@@ -664,6 +770,7 @@ class TestWizard(test.TestCase):
 
     @mock.patch('wizard.signals.wizard_pre_prereq.send')
     def test_sends_pre_prereq_signal_in_prereq(self, send_pre_prereq):
+        self.listen_to(wizard.signals.wizard_pre_prereq)
         wiz = wizard.Wizard('test:test3', self.steps)
         wiz.request = self.mock_request
         wiz.steps = dict(self.steps)
@@ -674,6 +781,7 @@ class TestWizard(test.TestCase):
     @mock.patch.object(TestStepFour, 'prereq', mocksignature=True)
     @mock.patch('wizard.signals.wizard_post_prereq.send')
     def test_does_not_send_post_prereq_signal_when_prereq_raises_exception(self, send_post_prereq, mock_prereq):
+        self.listen_to(wizard.signals.wizard_post_prereq)
         mock_prereq.side_effect = wizard.PrereqMissing
 
         wiz = wizard.Wizard('test:test3', self.steps)
@@ -687,6 +795,7 @@ class TestWizard(test.TestCase):
     @mock.patch.object(TestStepFour, 'prereq', mocksignature=True)
     @mock.patch('wizard.signals.wizard_pre_prereq.send')
     def test_should_still_send_pre_preq_signal_even_if_prereq_raises_exception(self, send_pre_prereq, mock_prereq):
+        self.listen_to(wizard.signals.wizard_pre_prereq)
         mock_prereq.side_effect = wizard.PrereqMissing
 
         wiz = wizard.Wizard('test:test3', self.steps)
@@ -718,6 +827,7 @@ class TestWizard(test.TestCase):
 
     @mock.patch('wizard.signals.wizard_post_prereq.send')
     def test_prereq_exceptions_are_not_caught_when_raised_by_post_prereq_signal(self, send_post_prereq):
+        self.listen_to(wizard.signals.wizard_post_prereq)
         send_post_prereq.side_effect = wizard.PrereqMissing
         wiz = wizard.Wizard('test:test3', self.steps)
         wiz.steps = dict(self.steps)
@@ -728,6 +838,7 @@ class TestWizard(test.TestCase):
 
     @mock.patch('wizard.signals.wizard_pre_prereq.send')
     def test_prereq_exceptions_are_not_caught_when_raised_by_pre_prereq_signal(self, send_pre_prereq):
+        self.listen_to(wizard.signals.wizard_pre_prereq)
         send_pre_prereq.side_effect = wizard.PrereqMissing
         wiz = wizard.Wizard('test:test3', self.steps)
         wiz.steps = dict(self.steps)
@@ -736,6 +847,224 @@ class TestWizard(test.TestCase):
         with self.assertRaises(wizard.PrereqMissing):
             wiz.current_step_object.prereq()
 
+    def test_check_prereq_returns_none_when_prereq_is_satisfied(self):
+        self.wizard.initialize_steps()
+        self.assertEqual(None, self.wizard.check_prereq('first'))
+
+    def test_check_prereq_returns_prereq_missing_exception(self):
+        self.steps[3] = ('fourth', get_class_with_missing_prereq('third'))
+        self.wizard.initialize_steps()
+        exception = self.wizard.check_prereq('fourth')
+        self.assertIsInstance(exception, wizard.PrereqMissing)
+        self.assertEqual('third', exception.step)
+
+    def test_check_prereq_only_runs_prereq_once_per_request(self):
+        self.wizard.handle_request(self.mock_request, 'second')
+        self.wizard.next_step_url()
+        self.wizard.prev_step_url()
+        self.wizard.next_step_url()
+        self.assertEqual(1, self.wizard.steps['third'].calls.count('prereq'))
+        self.assertEqual(1, self.wizard.steps['first'].calls.count('prereq'))
+
+    def test_check_prereq_remembers_missing_prereqs(self):
+        mock_step = get_class_with_missing_prereq('first')
+        self.steps[1] = ('second', mock_step)
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.wizard.next_step_url()
+        self.wizard.next_step_url()
+        self.assertEqual(1, mock_step.prereq.call_count)
+
+    def test_prereq_signals_are_sent_once_per_evaluation(self):
+        receiver = mock.Mock()
+        wizard.signals.wizard_pre_prereq.connect(receiver, weak=False)
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.wizard.next_step_url()
+        self.wizard.next_step_url()
+        self.assertEqual(['first', 'second'], [kwargs['step_key'] for _, kwargs in receiver.call_args_list])
+
+    def test_clears_prereq_results_after_save_in_post(self):
+        self.mock_request.method = 'POST'
+        self.mock_request.REQUEST = {'wizard_save': True}
+        mock_step = mock.MagicMock()
+        self.steps[0] = ('first', mock_step)
+        self.wizard.initialize_steps()
+        self.wizard.check_prereq('first')
+        self.wizard.post(self.mock_request, 'first')
+        self.assertEqual(2, mock_step.prereq.call_count)
+
+    def test_does_not_clear_prereq_results_when_save_fails(self):
+        mock_step = mock.MagicMock()
+        mock_step.save.side_effect = wizard.SaveStepException
+        self.steps[0] = ('first', mock_step)
+        self.wizard.initialize_steps()
+        self.wizard.check_prereq('first')
+        self.wizard.post(self.mock_request, 'first')
+        self.assertEqual(1, mock_step.prereq.call_count)
+
+    def test_clears_prereq_results_for_each_request(self):
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.assertEqual(['prereq', 'display', 'template'], self.wizard.steps['first'].calls)
+
+    def test_resolve_prereqs_calls_resolver_once_with_unchecked_steps(self):
+        resolver = mock.Mock(return_value={})
+        self.wizard.set_prereq_resolver(resolver)
+        self.wizard.initialize_steps()
+        self.wizard.check_prereq('first')
+        self.wizard.check_prereq('second')
+        resolver.assert_called_once_with(self.wizard, ['first', 'second', 'third', 'fourth', 'fifth'])
+
+    def test_resolver_results_are_used_instead_of_step_prereq(self):
+        missing = wizard.PrereqMissing('first')
+        self.wizard.set_prereq_resolver(mock.Mock(return_value={'second': None, 'third': missing}))
+        self.wizard.initialize_steps()
+        self.assertEqual(None, self.wizard.check_prereq('second'))
+        self.assertEqual(missing, self.wizard.check_prereq('third'))
+        self.assertEqual(TestStepTwo, self.wizard.steps['second'])
+        self.assertEqual(TestStepThree, self.wizard.steps['third'])
+
+    def test_falls_back_to_step_prereq_when_resolver_leaves_out_step(self):
+        self.wizard.set_prereq_resolver(mock.Mock(return_value={}))
+        self.wizard.initialize_steps()
+        self.wizard.check_prereq('second')
+        self.assertEqual(['prereq'], self.wizard.steps['second'].calls)
+
+    def test_does_not_ask_resolver_about_steps_already_checked(self):
+        resolver = mock.Mock(return_value={})
+        self.wizard.initialize_steps()
+        self.wizard.check_prereq('first')
+        self.wizard.set_prereq_resolver(resolver)
+        self.wizard.check_prereq('second')
+        resolver.assert_called_once_with(self.wizard, ['second', 'third', 'fourth', 'fifth'])
+
+    def test_resolves_prereqs_again_after_results_are_cleared(self):
+        resolver = mock.Mock(return_value={})
+        self.wizard.set_prereq_resolver(resolver)
+        self.wizard.initialize_steps()
+        self.wizard.check_prereq('first')
+        self.wizard.clear_prereq_results()
+        self.wizard.check_prereq('first')
+        self.assertEqual(2, resolver.call_count)
+
+    def test_handle_prereq_uses_resolver_results(self):
+        self.wizard.set_prereq_resolver(lambda wiz, keys: {'fourth': wizard.PrereqMissing('second')})
+        response = self.wizard.handle_request(self.mock_request, 'fourth')
+        self.assertEqual('/test/second', response['Location'])
+
+    def test_get_available_steps_only_returns_steps_with_satisfied_prereqs(self):
+        self.wizard.set_prereq_resolver(lambda wiz, keys: {
+            'second': wizard.PrereqMissing('first'),
+            'fourth': wizard.PrereqMissing('first'),
+        })
+        self.wizard.initialize_steps()
+        available = self.wizard.get_available_steps()
+        self.assertEqual(['first', 'third', 'fifth'], [name for name, _ in available])
+
+    def test_handle_prereq_records_path_taken(self):
+        self.steps[3] = ('fourth', get_class_with_missing_prereq('third'))
+        self.steps[2] = ('third', get_class_with_missing_prereq('second'))
+        self.wizard.handle_request(self.mock_request, 'fourth')
+        self.assertEqual(['fourth', 'third', 'second'], self.wizard.prereq_path)
+
+    def test_handle_prereq_records_path_when_turning_around(self):
+        self.steps[3] = ('fourth', get_class_with_missing_prereq('first'))
+        self.steps[4] = ('fifth', get_class_with_missing_prereq('first'))
+        self.wizard.initialize_steps()
+        self.assertEqual('third', self.wizard.handle_prereq('fourth', 1))
+        self.assertEqual(['fourth', 'fifth', 'fifth', 'fourth', 'third'], self.wizard.prereq_path)
+
+    def test_handle_prereq_raises_resolution_error_when_prereqs_form_a_cycle(self):
+        self.steps[1] = ('second', get_class_with_missing_prereq('third'))
+        self.steps[2] = ('third', get_class_with_missing_prereq('second'))
+        self.wizard.initialize_steps()
+        with self.assertRaises(wizard.PrereqResolutionError) as context:
+            self.wizard.handle_prereq('second')
+        self.assertEqual(['second', 'third', 'second'], context.exception.path)
+
+    def test_handle_prereq_raises_resolution_error_when_no_step_is_available(self):
+        self.steps = [(key, get_class_with_missing_prereq('first')) for key, _ in self.steps]
+        self.wizard.steps_callback = self.steps
+        self.wizard.initialize_steps()
+        self.assertRaises(wizard.PrereqResolutionError, self.wizard.handle_prereq, 'third', 1)
+
+    def test_handle_prereq_raises_resolution_error_when_exceeding_max_hops(self):
+        self.steps[3] = ('fourth', get_class_with_missing_prereq('third'))
+        self.steps[2] = ('third', get_class_with_missing_prereq('second'))
+        self.wizard.max_prereq_hops = 1
+        self.wizard.initialize_steps()
+        with self.assertRaises(wizard.PrereqResolutionError) as context:
+            self.wizard.handle_prereq('fourth')
+        self.assertEqual(['fourth', 'third', 'second'], context.exception.path)
+
+    def test_handle_prereq_allows_hops_up_to_max_hops(self):
+        self.steps[3] = ('fourth', get_class_with_missing_prereq('third'))
+        self.steps[2] = ('third', get_class_with_missing_prereq('second'))
+        self.wizard.max_prereq_hops = 2
+        self.wizard.initialize_steps()
+        self.assertEqual('second', self.wizard.handle_prereq('fourth'))
+
+    def test_handle_prereq_follows_long_chains_without_recursion(self):
+        class ChainedStep(TestStepOne):
+            def prereq(self):
+                raise wizard.PrereqMissing('step%d' % (int(self._key[4:]) - 1))
+
+        step_count = sys.getrecursionlimit() * 2
+        steps = [('step%d' % i, ChainedStep) for i in range(1, step_count)]
+        wiz = wizard.Wizard('test:test1', [('step0', TestStepOne)] + steps)
+        wiz.initialize_steps()
+        self.assertEqual('step0', wiz.handle_prereq('step%d' % (step_count - 1)))
+
+    @mock.patch('wizard.signals.wizard_pre_save.send')
+    def test_does_not_send_signals_without_receivers(self, send_presave):
+        self.mock_request.method = 'POST'
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.assertFalse(send_presave.called)
+
+    def test_does_not_wrap_prereq_without_receivers(self):
+        self.wizard.initialize_steps()
+        step = self.wizard.get_step_object_by_key('first')
+        self.assertEqual(step, step.prereq.im_self)
+
+    def test_wraps_prereq_when_prereq_signal_has_receivers(self):
+        self.listen_to(wizard.signals.wizard_post_prereq)
+        self.wizard.initialize_steps()
+        step = self.wizard.get_step_object_by_key('first')
+        self.assertFalse(hasattr(step.prereq, 'im_self'))
+
+    def test_send_signal_sends_signal_to_receivers(self):
+        receiver = self.listen_to(wizard.signals.wizard_pre_display)
+        self.wizard.request = self.mock_request
+        self.wizard.send_signal('pre_display', 'first')
+        receiver.assert_called_once_with(signal=wizard.signals.wizard_pre_display, sender=self.wizard,
+            step_key='first', request=self.mock_request)
+
+    def test_does_not_keep_phase_log_without_request_finished_receivers(self):
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.assertEqual(None, self.wizard.phase_log)
+
+    def test_sends_request_finished_signal_with_phase_log(self):
+        receiver = self.listen_to(wizard.signals.wizard_request_finished)
+        self.mock_request.method = 'POST'
+        self.mock_request.REQUEST = {'wizard_continue': True}
+        response = self.wizard.handle_request(self.mock_request, 'first')
+        receiver.assert_called_once_with(signal=wizard.signals.wizard_request_finished, sender=self.wizard,
+            request=self.mock_request, response=response, phases=[
+                ('pre_save', 'first'),
+                ('post_save', 'first'),
+                ('pre_prereq', 'second'),
+                ('post_prereq', 'second'),
+            ])
+
+    def test_phase_log_includes_display_phases(self):
+        self.listen_to(wizard.signals.wizard_request_finished)
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.assertEqual([
+            ('pre_prereq', 'first'),
+            ('post_prereq', 'first'),
+            ('pre_display', 'first'),
+            ('post_display', 'first'),
+        ], self.wizard.phase_log)
+
     def test_request_is_none_before_handle_request(self):
         wiz = wizard.Wizard('test:test3', self.steps)
         self.assertEqual(None, wiz.request)
@@ -755,3 +1084,1599 @@ class TestWizard(test.TestCase):
             self.assertEqual(declared_steps[0], instantiated_steps[0])
             self.assertIsInstance(instantiated_steps[1], declared_steps[1])
 
+
+class TestWizardDefinition(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        self.steps = [
+                ('first', TestStepOne),
+                ('second', TestStepTwo),
+                ('third', TestStepThree),
+        ]
+        self.definition = wizard.WizardDefinition('test:test1', self.steps)
+        self.mock_request = mock.MagicMock()
+        self.mock_request.method = 'GET'
+
+    def test_freezes_steps_into_tuple_of_tuples(self):
+        self.assertEqual(tuple(tuple(s) for s in self.steps), self.definition.steps_callback)
+
+    def test_builds_steps_lookup_dict(self):
+        self.assertEqual(dict(self.steps), self.definition.steps)
+
+    def test_keeps_callable_steps_callback(self):
+        steps_callback = mock.Mock()
+        definition = wizard.WizardDefinition('test:test1', steps_callback)
+        self.assertEqual(steps_callback, definition.steps_callback)
+        self.assertEqual(None, definition.steps)
+
+    def test_uses_default_navigation_opts(self):
+        self.assertEqual(dict(wizard.DEFAULT_NAVIGATION_OPTS), self.definition.navigation_opts)
+
+    def test_does_not_allow_attributes_to_be_set(self):
+        with self.assertRaises(AttributeError):
+            self.definition.base_url_name = 'test:test2'
+
+    def test_does_not_allow_attributes_to_be_deleted(self):
+        with self.assertRaises(AttributeError):
+            del self.definition.base_url_name
+
+    def test_does_not_allow_steps_to_be_changed(self):
+        with self.assertRaises(TypeError):
+            self.definition.steps['fourth'] = TestStepFour
+
+    def test_does_not_allow_navigation_opts_to_be_changed(self):
+        with self.assertRaises(TypeError):
+            self.definition.navigation_opts.update({'next': 1})
+
+    def test_is_not_affected_by_changes_to_original_steps(self):
+        self.steps[0] = ('first', TestStepFour)
+        self.assertEqual(TestStepOne, self.definition.steps['first'])
+
+    def test_create_wizard_returns_wizard_bound_to_definition(self):
+        wiz = self.definition.create_wizard()
+        self.assertIsInstance(wiz, wizard.Wizard)
+        self.assertEqual(self.definition, wiz.definition)
+        self.assertEqual('test:test1', wiz.base_url_name)
+        self.assertEqual(self.definition.navigation_opts, wiz.navigation_opts)
+
+    def test_create_wizard_returns_new_wizard_each_time(self):
+        self.assertNotEqual(self.definition.create_wizard(), self.definition.create_wizard())
+
+    def test_wizard_shares_steps_tuple_with_definition(self):
+        wiz = self.definition.create_wizard()
+        wiz.initialize_steps()
+        self.assertTrue(wiz.steps_tuple is self.definition.steps_callback)
+
+    def test_handling_request_does_not_modify_definition(self):
+        wiz = self.definition.create_wizard()
+        wiz.set_step_init_args(self.mock_request)
+        response = wiz.handle_request(self.mock_request, 'second')
+
+        self.assertEqual(200, response.status_code)
+        self.assertIsInstance(wiz.steps['second'], TestStepTwo)
+        self.assertEqual(TestStepTwo, self.definition.steps['second'])
+
+    def test_calls_steps_callback_for_every_request_without_steps_cache_key(self):
+        steps_callback = mock.Mock(return_value=self.steps)
+        definition = wizard.WizardDefinition('test:test1', steps_callback)
+        definition.create_wizard().initialize_steps(self.mock_request)
+        definition.create_wizard().initialize_steps(self.mock_request)
+        self.assertEqual(2, steps_callback.call_count)
+
+    def test_caches_steps_between_requests_by_steps_cache_key(self):
+        steps_callback = mock.Mock(return_value=self.steps)
+        definition = wizard.WizardDefinition('test:test1', steps_callback, steps_cache_key=lambda request: 'admin')
+        first_wizard, second_wizard = definition.create_wizard(), definition.create_wizard()
+        first_wizard.initialize_steps(mock.Mock())
+        second_wizard.initialize_steps(mock.Mock())
+
+        self.assertEqual(1, steps_callback.call_count)
+        self.assertTrue(first_wizard.steps_tuple is second_wizard.steps_tuple)
+        self.assertEqual(dict(self.steps), second_wizard.steps)
+        self.assertEqual(1, second_wizard.get_step_position('second'))
+
+    def test_calls_steps_callback_for_each_steps_cache_key(self):
+        steps_callback = mock.Mock(return_value=self.steps)
+        definition = wizard.WizardDefinition('test:test1', steps_callback, steps_cache_key=lambda request: request.role)
+        definition.create_wizard().initialize_steps(mock.Mock(role='admin'))
+        definition.create_wizard().initialize_steps(mock.Mock(role='user'))
+        definition.create_wizard().initialize_steps(mock.Mock(role='admin'))
+        self.assertEqual(2, steps_callback.call_count)
+
+    def test_uses_steps_cache_size_and_timeout(self):
+        definition = wizard.WizardDefinition('test:test1', mock.Mock(), steps_cache_key=mock.Mock(),
+            steps_cache_size=10, steps_cache_timeout=60)
+        self.assertEqual(10, definition.steps_cache.max_size)
+        self.assertEqual(60, definition.steps_cache.timeout)
+
+    def test_does_not_create_steps_cache_for_static_steps(self):
+        definition = wizard.WizardDefinition('test:test1', self.steps, steps_cache_key=mock.Mock())
+        self.assertEqual(None, definition.steps_cache)
+
+    def test_wizard_shares_step_index_with_definition(self):
+        wiz = self.definition.create_wizard()
+        wiz.initialize_steps()
+        self.assertEqual(self.definition.step_index, (wiz.step_keys, wiz.step_positions))
+        self.assertEqual(2, wiz.get_step_position('third'))
+
+    def test_calls_steps_callback_for_wizards_created_from_definition(self):
+        steps_callback = mock.Mock(return_value=self.steps)
+        wiz = wizard.WizardDefinition('test:test1', steps_callback).create_wizard()
+        wiz.initialize_steps(self.mock_request)
+        steps_callback.assert_called_once_with(self.mock_request)
+        self.assertEqual(dict(self.steps), wiz.steps)
+
+
+class NamedTemplateStep(MoniterStep):
+    template_name = 'step.html'
+
+
+@override_settings(WIZARD_TEMPLATE_AUTO_RELOAD=False)
+class TestWizardTemplateCache(test.TestCase):
+
+    def setUp(self):
+        wizard.clear_template_cache()
+        self.wizard = wizard.Wizard('test:test1', [('first', NamedTemplateStep)])
+
+    def tearDown(self):
+        wizard.clear_template_cache()
+
+    def test_loads_template_once_for_step_class_and_template_name(self):
+        first_step, second_step = NamedTemplateStep(), NamedTemplateStep()
+        template = self.wizard.get_template(first_step)
+        self.assertEqual(template, self.wizard.get_template(second_step))
+        self.assertEqual(['template'], first_step.calls)
+        self.assertEqual([], second_step.calls)
+
+    def test_caches_each_template_name_separately(self):
+        first_step, second_step = NamedTemplateStep(), NamedTemplateStep()
+        second_step.template_name = 'other.html'
+        self.wizard.get_template(first_step)
+        self.wizard.get_template(second_step)
+        self.assertEqual(['template'], second_step.calls)
+
+    def test_caches_each_step_class_separately(self):
+        class OtherStep(NamedTemplateStep):
+            pass
+
+        self.wizard.get_template(NamedTemplateStep())
+        other_step = OtherStep()
+        self.wizard.get_template(other_step)
+        self.assertEqual(['template'], other_step.calls)
+
+    def test_does_not_cache_steps_without_template_name(self):
+        step = MoniterStep()
+        self.wizard.get_template(step)
+        self.wizard.get_template(step)
+        self.assertEqual(['template', 'template'], step.calls)
+
+    @override_settings(WIZARD_TEMPLATE_AUTO_RELOAD=True)
+    def test_does_not_cache_when_auto_reload_is_on(self):
+        step = NamedTemplateStep()
+        self.wizard.get_template(step)
+        self.wizard.get_template(step)
+        self.assertEqual(['template', 'template'], step.calls)
+
+    def test_clear_template_cache_forgets_cached_templates(self):
+        self.wizard.get_template(NamedTemplateStep())
+        wizard.clear_template_cache()
+        step = NamedTemplateStep()
+        self.wizard.get_template(step)
+        self.assertEqual(['template'], step.calls)
+
+    @mock.patch('wizard.Wizard.get_template')
+    def test_render_uses_get_template(self, get_template):
+        get_template.return_value = Template("rendered")
+        self.wizard.initialize_steps()
+        response = self.wizard.render(mock.MagicMock(), {}, 'first')
+        get_template.assert_called_once_with(self.wizard.steps['first'])
+        self.assertEqual('rendered', response.content)
+
+
+class TestReverse(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        wizard.clear_url_cache()
+
+    def tearDown(self):
+        wizard.clear_url_cache()
+
+    def test_returns_reversed_url(self):
+        self.assertEqual('/test/1234/first', wizard.reverse('test:test2', kwargs={'asdf': 1234, 'step': 'first'}))
+
+    @mock.patch('django.core.urlresolvers.reverse')
+    def test_only_reverses_each_url_once(self, reverse):
+        reverse.return_value = '/test/first'
+        wizard.reverse('test:test1', kwargs={'step': 'first'})
+        self.assertEqual('/test/first', wizard.reverse('test:test1', kwargs={'step': 'first'}))
+        reverse.assert_called_once_with('test:test1', args=None, kwargs={'step': 'first'})
+
+    @mock.patch('django.core.urlresolvers.reverse')
+    def test_reverses_different_arguments_separately(self, reverse):
+        wizard.reverse('test:test3', args=(1234, 'asdf', 'first'))
+        wizard.reverse('test:test3', args=(1234, 'asdf', 'second'))
+        self.assertEqual(2, reverse.call_count)
+
+    @mock.patch('django.core.urlresolvers.get_script_prefix')
+    @mock.patch('django.core.urlresolvers.reverse')
+    def test_reverses_again_for_different_script_prefix(self, reverse, get_script_prefix):
+        get_script_prefix.return_value = '/'
+        wizard.reverse('test:test1', kwargs={'step': 'first'})
+        get_script_prefix.return_value = '/other/'
+        wizard.reverse('test:test1', kwargs={'step': 'first'})
+        self.assertEqual(2, reverse.call_count)
+
+    @mock.patch('django.core.urlresolvers.reverse')
+    def test_reverses_again_for_different_language(self, reverse):
+        with mock.patch('django.utils.translation.get_language', mock.Mock(return_value='en')):
+            wizard.reverse('test:test1', kwargs={'step': 'first'})
+        with mock.patch('django.utils.translation.get_language', mock.Mock(return_value='de')):
+            wizard.reverse('test:test1', kwargs={'step': 'first'})
+        self.assertEqual(2, reverse.call_count)
+
+    @mock.patch('django.core.urlresolvers.reverse')
+    def test_does_not_cache_unhashable_arguments(self, reverse):
+        wizard.reverse('test:test1', kwargs={'step': ['first']})
+        wizard.reverse('test:test1', kwargs={'step': ['first']})
+        self.assertEqual(2, reverse.call_count)
+
+    def test_does_not_cache_failed_reverse(self):
+        self.assertRaises(urlresolvers.NoReverseMatch, wizard.reverse, 'test:test2', kwargs={'xxxx': 1})
+        self.assertEqual(0, len(wizard._url_cache))
+
+
+class TestLRUCache(test.TestCase):
+
+    def setUp(self):
+        self.cache = LRUCache(max_size=2)
+
+    def test_returns_default_for_missing_key(self):
+        self.assertEqual('default', self.cache.get('missing', 'default'))
+
+    def test_returns_value_that_was_set(self):
+        self.cache.set('key', 'value')
+        self.assertEqual('value', self.cache.get('key'))
+
+    def test_throws_away_least_recently_used_item_when_full(self):
+        self.cache.set('first', 1)
+        self.cache.set('second', 2)
+        self.cache.get('first')
+        self.cache.set('third', 3)
+        self.assertEqual(2, len(self.cache))
+        self.assertTrue('first' in self.cache)
+        self.assertFalse('second' in self.cache)
+
+    @mock.patch('time.time')
+    def test_items_expire_after_timeout(self, time):
+        cache = LRUCache(timeout=10)
+        time.return_value = 100
+        cache.set('key', 'value')
+        time.return_value = 109
+        self.assertEqual('value', cache.get('key'))
+        self.assertTrue('key' in cache)
+        time.return_value = 110
+        self.assertEqual(None, cache.get('key'))
+        self.assertFalse('key' in cache)
+
+    def test_delete_removes_item(self):
+        self.cache.set('key', 'value')
+        self.cache.delete('key')
+        self.assertFalse('key' in self.cache)
+
+    def test_clear_removes_all_items(self):
+        self.cache.set('key', 'value')
+        self.cache.clear()
+        self.assertEqual(0, len(self.cache))
+
+
+class TestWizardInstrumentation(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        self.steps = [
+            ('first', TestStepOne),
+            ('second', TestStepTwo),
+        ]
+        self.mock_request = mock.MagicMock()
+        self.mock_request.method = 'GET'
+        self.wizard = wizard.Wizard('test:test1', self.steps)
+        self.sink = instrumentation.MemorySink()
+
+    def test_timings_are_none_without_instrumentation(self):
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.assertEqual(None, self.wizard.timings)
+
+    def test_timed_returns_null_timer_without_instrumentation(self):
+        self.assertEqual(instrumentation.NULL_TIMER, self.wizard.timed('display', 'first'))
+
+    def test_records_phases_of_get_request(self):
+        self.wizard.set_instrumentation()
+        self.wizard.handle_request(self.mock_request, 'first')
+        timings = self.wizard.timings
+        self.assertEqual(['display', 'prereq', 'render'], sorted(timings.phases.keys()))
+        self.assertEqual(1, timings.phases['display'][0])
+        self.assertEqual(1, timings.steps[('prereq', 'first')][0])
+        self.assertTrue(timings.total >= timings.phases['render'][1])
+
+    def test_records_phases_of_post_request(self):
+        self.wizard.set_instrumentation()
+        self.mock_request.method = 'POST'
+        self.mock_request.REQUEST = {'wizard_continue': True}
+        self.wizard.handle_request(self.mock_request, 'first')
+        timings = self.wizard.timings
+        self.assertEqual(['prereq', 'save', 'url'], sorted(timings.phases.keys()))
+        self.assertEqual(1, timings.steps[('save', 'first')][0])
+        self.assertEqual(1, timings.steps[('url', 'second')][0])
+
+    def test_starts_new_timings_for_each_request(self):
+        self.wizard.set_instrumentation(self.sink)
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.assertEqual(2, len(self.sink.timings))
+        self.assertNotEqual(self.sink.timings[0], self.sink.timings[1])
+        self.assertEqual(1, self.sink.timings[1].phases['display'][0])
+
+    def test_emits_timings_to_sink(self):
+        self.wizard.set_instrumentation(self.sink)
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.assertEqual([self.wizard.timings], self.sink.timings)
+
+    def test_adds_server_timing_header(self):
+        self.wizard.set_instrumentation(server_timing=True)
+        response = self.wizard.handle_request(self.mock_request, 'first')
+        self.assertEqual(self.wizard.timings.server_timing(), response['Server-Timing'])
+
+    def test_does_not_add_server_timing_header_unless_asked(self):
+        self.wizard.set_instrumentation(self.sink)
+        response = self.wizard.handle_request(self.mock_request, 'first')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class TestTimings(test.TestCase):
+
+    def setUp(self):
+        self.timings = instrumentation.Timings()
+
+    def test_record_adds_to_phase_and_step_totals(self):
+        self.timings.record('display', 'first', 0.5)
+        self.timings.record('display', 'second', 0.25)
+        self.assertEqual((2, 0.75), self.timings.phases['display'])
+        self.assertEqual((1, 0.25), self.timings.steps[('display', 'second')])
+
+    @mock.patch('wizard.instrumentation.default_timer')
+    def test_time_records_time_spent_in_block(self, default_timer):
+        default_timer.side_effect = [1.0, 1.5]
+        with self.timings.time('save', 'first'):
+            pass
+        self.assertEqual((1, 0.5), self.timings.phases['save'])
+
+    def test_time_records_time_when_block_raises(self):
+        with self.assertRaises(ValueError):
+            with self.timings.time('save', 'first'):
+                raise ValueError
+        self.assertEqual(1, self.timings.phases['save'][0])
+
+    def test_server_timing_lists_phases_in_milliseconds(self):
+        self.timings.record('render', 'first', 0.002)
+        self.timings.record('display', 'first', 0.001)
+        self.timings.total = 0.004
+        self.assertEqual('display;dur=1.000, render;dur=2.000, total;dur=4.000', self.timings.server_timing())
+
+
+class TestInstrumentationSinks(test.TestCase):
+
+    def setUp(self):
+        self.wizard = mock.Mock(base_url_name='test:test1', _current_step='first')
+        self.timings = instrumentation.Timings()
+        self.timings.record('display', 'first', 0.001)
+        self.timings.total = 0.002
+
+    def test_logging_sink_logs_server_timing(self):
+        logger = mock.Mock()
+        instrumentation.LoggingSink(logger).emit(self.wizard, self.timings)
+        logger.log.assert_called_once_with(logging.INFO, "wizard %s step %s: %s",
+            'test:test1', 'first', 'display;dur=1.000, total;dur=2.000')
+
+    def test_statsd_sink_sends_timings_over_udp(self):
+        sink = instrumentation.StatsdSink('localhost', 9999, prefix='app')
+        sink.socket = mock.Mock()
+        sink.emit(self.wizard, self.timings)
+        sink.socket.sendto.assert_called_once_with(
+            "app.total:2.000|ms\napp.display:1.000|ms\napp.display.calls:1|c\napp.display.first:1.000|ms",
+            ('localhost', 9999))
+
+    def test_statsd_sink_ignores_socket_errors(self):
+        sink = instrumentation.StatsdSink()
+        sink.socket = mock.Mock()
+        sink.socket.sendto.side_effect = socket.error
+        sink.emit(self.wizard, self.timings)
+
+
+class TestWizardStateStore(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        self.mock_request = mock.MagicMock()
+        self.mock_request.method = 'GET'
+        self.store = storage.MemoryStateStore()
+        self.wizard = wizard.Wizard('test:test1', [('first', TestStepOne), ('second', TestStepTwo)])
+
+    def test_state_is_none_without_store(self):
+        self.assertEqual(None, self.wizard.state)
+
+    def test_set_state_store_makes_store_available_to_steps(self):
+        self.wizard.set_state_store(self.store)
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.assertEqual(self.store, self.wizard.steps['first']._wizard.state)
+
+    def test_persists_state_at_end_of_request(self):
+        class StashingStep(TestStepOne):
+            def save(self):
+                self._wizard.state.set(self._key, {'name': 'value'})
+
+        self.wizard.steps_callback = [('first', StashingStep), ('second', TestStepTwo)]
+        self.wizard.set_state_store(self.store)
+        self.mock_request.method = 'POST'
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.assertEqual({'first': {'name': 'value'}}, self.store.saved)
+
+    def test_persist_is_given_response(self):
+        store = mock.Mock()
+        self.wizard.set_state_store(store)
+        response = self.wizard.handle_request(self.mock_request, 'first')
+        store.persist.assert_called_once_with(response)
+
+    @mock.patch('django.db.transaction.commit_on_success')
+    def test_commit_state_hands_all_data_to_on_commit_in_transaction(self, commit_on_success):
+        def on_commit(data):
+            self.assertTrue(commit_on_success.return_value.__enter__.called)
+            self.assertFalse(commit_on_success.return_value.__exit__.called)
+            return data
+
+        self.store.set('first', {'name': 'value'})
+        self.store.set('second', {'address': 'here'})
+        self.wizard.set_state_store(self.store, on_commit)
+        result = self.wizard.commit_state()
+        self.assertEqual({'first': {'name': 'value'}, 'second': {'address': 'here'}}, result)
+        self.assertTrue(commit_on_success.return_value.__exit__.called)
+
+    def test_commit_state_clears_store(self):
+        self.store.set('first', {'name': 'value'})
+        self.wizard.set_state_store(self.store, mock.Mock())
+        self.wizard.commit_state()
+        self.assertEqual({}, self.store.all())
+
+    def test_commit_state_does_not_clear_store_when_on_commit_fails(self):
+        self.store.set('first', {'name': 'value'})
+        self.wizard.set_state_store(self.store, mock.Mock(side_effect=ValueError))
+        self.assertRaises(ValueError, self.wizard.commit_state)
+        self.assertEqual({'first': {'name': 'value'}}, self.store.all())
+
+
+class FakeSession(dict):
+    modified = False
+
+
+class TestStateStores(test.TestCase):
+
+    def test_memory_store_gets_data_that_was_set(self):
+        store = storage.MemoryStateStore()
+        store.set('first', {'name': 'value'})
+        self.assertEqual({'name': 'value'}, store.get('first'))
+        self.assertTrue('first' in store)
+
+    def test_memory_store_returns_default_for_missing_step(self):
+        self.assertEqual('default', storage.MemoryStateStore().get('first', 'default'))
+
+    def test_all_leaves_out_wizard_entries(self):
+        store = storage.MemoryStateStore({'first': 1, '__work__': [], 2: 'two'})
+        self.assertEqual({'first': 1, 2: 'two'}, store.all())
+
+    def test_memory_store_only_saves_when_modified(self):
+        store = storage.MemoryStateStore({'first': 1})
+        store.save = mock.Mock()
+        store.get('first')
+        store.persist(None)
+        self.assertFalse(store.save.called)
+
+    def test_memory_store_saves_data_on_persist(self):
+        store = storage.MemoryStateStore({'first': 1})
+        store.set('second', 2)
+        store.delete('first')
+        store.persist(None)
+        self.assertEqual({'second': 2}, store.saved)
+
+    def test_session_store_loads_data_from_session(self):
+        request = mock.Mock(session=FakeSession(wizard={'first': 1}))
+        self.assertEqual(1, storage.SessionStateStore(request).get('first'))
+
+    def test_session_store_saves_data_to_session(self):
+        request = mock.Mock(session=FakeSession())
+        store = storage.SessionStateStore(request, prefix='my_wizard')
+        store.set('first', 1)
+        store.persist(None)
+        self.assertEqual({'my_wizard': {'first': 1}}, request.session)
+        self.assertTrue(request.session.modified)
+
+    def test_session_store_removes_data_from_session_when_cleared(self):
+        request = mock.Mock(session=FakeSession(wizard={'first': 1}))
+        store = storage.SessionStateStore(request)
+        store.clear()
+        store.persist(None)
+        self.assertEqual({}, request.session)
+
+    def test_cache_store_saves_and_loads_data_from_cache(self):
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        store = storage.CacheStateStore('session-key', cache=cache)
+        store.set('first', 1)
+        store.persist(None)
+        self.assertEqual({'first': 1}, cache.get('wizard:session-key'))
+        self.assertEqual(1, storage.CacheStateStore('session-key', cache=cache).get('first'))
+
+    def test_cache_store_deletes_data_from_cache_when_cleared(self):
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        cache.set('wizard:session-key', {'first': 1})
+        store = storage.CacheStateStore('session-key', cache=cache)
+        store.clear()
+        store.persist(None)
+        self.assertEqual(None, cache.get('wizard:session-key'))
+
+    def test_cookie_store_saves_and_loads_data_from_signed_cookie(self):
+        store = storage.CookieStateStore(RequestFactory().get('/'))
+        store.set('first', {'name': 'value'})
+        response = http.HttpResponse()
+        store.persist(response)
+
+        request = RequestFactory().get('/')
+        request.COOKIES['wizard'] = response.cookies['wizard'].value
+        self.assertEqual({'name': 'value'}, storage.CookieStateStore(request).get('first'))
+
+    def test_cookie_store_ignores_tampered_cookie(self):
+        request = RequestFactory().get('/')
+        request.COOKIES['wizard'] = '{"first": 1}:bad-signature'
+        self.assertEqual(None, storage.CookieStateStore(request).get('first'))
+
+    def test_cookie_store_deletes_cookie_when_cleared(self):
+        store = storage.CookieStateStore(RequestFactory().get('/'))
+        store.clear()
+        response = http.HttpResponse()
+        store.persist(response)
+        self.assertEqual('', response.cookies['wizard'].value)
+
+
+class QueueingStep(TestStepOne):
+    flush_work = False
+
+    def save(self):
+        self._wizard.work.call(self.calls.append, 'written')
+        if getattr(self, 'fail', False):
+            raise wizard.SaveStepException
+
+
+class TestWizardUnitOfWork(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        self.mock_request = mock.MagicMock()
+        self.mock_request.method = 'POST'
+        self.mock_request.REQUEST = {}
+        self.wizard = wizard.Wizard('test:test1', [('first', QueueingStep), ('second', TestStepTwo)])
+        self.wizard.set_unit_of_work()
+
+    def test_work_is_none_by_default(self):
+        self.assertEqual(None, wizard.Wizard('test:test1', []).work)
+
+    def test_set_unit_of_work_uses_given_unit_of_work(self):
+        work = UnitOfWork()
+        self.wizard.set_unit_of_work(work)
+        self.assertEqual(work, self.wizard.work)
+
+    def test_flushes_work_after_save_without_state_store(self):
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.assertTrue('written' in self.wizard.steps['first'].calls)
+        self.assertEqual(0, len(self.wizard.work))
+
+    def test_keeps_work_in_state_store_between_requests(self):
+        store = storage.MemoryStateStore()
+        self.wizard.set_state_store(store)
+        self.wizard.handle_request(self.mock_request, 'first')
+
+        self.assertEqual(1, len(self.wizard.work))
+        self.assertEqual(self.wizard.work.operations, store.saved[wizard.WORK_STATE_KEY])
+
+        next_wizard = wizard.Wizard('test:test1', [('first', QueueingStep), ('second', TestStepTwo)])
+        next_wizard.set_unit_of_work()
+        next_wizard.set_state_store(storage.MemoryStateStore(store.saved))
+        self.mock_request.method = 'GET'
+        next_wizard.handle_request(self.mock_request, 'second')
+        self.assertEqual(1, len(next_wizard.work))
+
+    def test_flushes_work_after_save_of_step_with_flush_work(self):
+        self.wizard.set_state_store(storage.MemoryStateStore())
+        with mock.patch.object(QueueingStep, 'flush_work', True):
+            self.wizard.handle_request(self.mock_request, 'first')
+        self.assertEqual(0, len(self.wizard.work))
+
+    def test_throws_away_only_failed_step_work_on_save_step_exception(self):
+        self.wizard.set_state_store(storage.MemoryStateStore())
+        self.wizard.work.begin_step('other')
+        self.wizard.work.call(mock.Mock())
+        self.wizard.work.end_step()
+        other_operations = list(self.wizard.work.operations)
+
+        self.wizard.initialize_steps()
+        with mock.patch.object(QueueingStep, 'fail', True, create=True):
+            response = self.wizard.post(self.mock_request, 'first')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(other_operations, self.wizard.work.operations)
+
+    def test_step_saved_again_replaces_its_work(self):
+        self.wizard.set_state_store(storage.MemoryStateStore())
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.wizard.handle_request(self.mock_request, 'first')
+        self.assertEqual(1, len(self.wizard.work))
+
+    def test_rejects_state_store_that_cannot_keep_work(self):
+        store = storage.CookieStateStore(RequestFactory().get('/'))
+        self.assertRaises(ValueError, self.wizard.set_state_store, store)
+
+        test_wizard = wizard.Wizard('test:test1', [])
+        test_wizard.set_state_store(store)
+        self.assertRaises(ValueError, test_wizard.set_unit_of_work)
+
+    @mock.patch('django.db.transaction.commit_on_success')
+    def test_commit_state_makes_queued_writes_in_same_transaction_as_on_commit(self, commit_on_success):
+        written = []
+        self.wizard.set_state_store(storage.MemoryStateStore(), lambda data: written.append('committed'))
+        self.wizard.work.call(written.append, 'written')
+        self.wizard.commit_state()
+        self.assertEqual(['written', 'committed'], written)
+        commit_on_success.assert_called_once_with()
+        self.assertEqual(0, len(self.wizard.work))
+
+
+class TestUnitOfWork(test.TestCase):
+
+    def setUp(self):
+        self.work = UnitOfWork()
+
+    def test_queues_operations_tagged_with_current_step(self):
+        instance = mock.Mock()
+        self.work.begin_step('first')
+        self.work.save(instance)
+        self.assertEqual([('first', 'save', instance)], self.work.operations)
+        self.assertTrue(self.work.modified)
+
+    def test_rollback_step_throws_away_operations_since_begin_step(self):
+        self.work.call(mock.Mock())
+        self.work.begin_step('first')
+        self.work.call(mock.Mock())
+        self.work.rollback_step()
+        self.assertEqual(1, len(self.work))
+
+    def test_end_step_throws_away_operations_queued_by_earlier_save_of_step(self):
+        earlier, later, other = mock.Mock(), mock.Mock(), mock.Mock()
+        self.work.begin_step('first')
+        self.work.save(earlier)
+        self.work.end_step()
+        self.work.begin_step('second')
+        self.work.save(other)
+        self.work.end_step()
+        self.work.begin_step('first')
+        self.work.save(later)
+        self.work.end_step()
+        self.assertEqual([other, later], [payload for _, _, payload in self.work.operations])
+
+    def test_run_saves_instances(self):
+        instance = mock.Mock()
+        self.work.save(instance)
+        self.work.run()
+        instance.save.assert_called_once_with(using=None)
+
+    def test_run_calls_callables(self):
+        func = mock.Mock()
+        self.work.call(func, 1, two=2)
+        self.work.run()
+        func.assert_called_once_with(1, two=2)
+
+    def test_run_combines_consecutive_bulk_creates_for_same_model(self):
+        model = mock.Mock()
+        self.work.bulk_create(model, [1, 2])
+        self.work.bulk_create(model, [3])
+        self.work.run()
+        model.objects.db_manager.return_value.bulk_create.assert_called_once_with([1, 2, 3])
+
+    def test_run_keeps_order_of_operations(self):
+        written = []
+        model = mock.Mock()
+        model.objects.db_manager.return_value.bulk_create.side_effect = lambda objects: written.append(objects)
+        self.work.bulk_create(model, [1])
+        self.work.call(written.append, 'call')
+        self.work.bulk_create(model, [2])
+        self.work.run()
+        self.assertEqual([[1], 'call', [2]], written)
+
+    def test_run_empties_queue(self):
+        self.work.call(mock.Mock())
+        self.work.run()
+        self.assertEqual(0, len(self.work))
+
+    @mock.patch('django.db.transaction.commit_on_success')
+    def test_flush_runs_operations_in_transaction(self, commit_on_success):
+        func = mock.Mock(side_effect=lambda: self.assertTrue(commit_on_success.return_value.__enter__.called))
+        self.work.call(func)
+        self.work.flush(using='other')
+        commit_on_success.assert_called_once_with(using='other')
+        self.assertTrue(func.called)
+
+
+class IndependentStep(TestStepOne):
+    independent_prereq = True
+    missing = None
+
+    def prereq(self):
+        self.calls.append(threading.current_thread().ident)
+        if self.missing:
+            raise wizard.PrereqMissing(self.missing)
+
+
+class MissingIndependentStep(IndependentStep):
+    missing = 'first'
+
+
+class TestWizardPrereqConcurrency(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        self.steps = [
+            ('first', TestStepOne),
+            ('second', IndependentStep),
+            ('third', MissingIndependentStep),
+            ('fourth', IndependentStep),
+            ('fifth', TestStepFive),
+        ]
+        self.wizard = wizard.Wizard('test:test1', self.steps)
+        self.wizard.initialize_steps()
+
+    def test_does_not_evaluate_prereqs_ahead_of_time_by_default(self):
+        self.wizard.evaluate_prereqs(['second', 'third', 'fourth'])
+        self.assertEqual({}, self.wizard._prereq_results)
+
+    def test_evaluates_independent_prereqs_on_thread_pool(self):
+        self.wizard.set_prereq_concurrency(2)
+        self.wizard.evaluate_prereqs(['first', 'second', 'third', 'fourth', 'fifth'])
+
+        self.assertEqual(['fourth', 'second', 'third'], sorted(self.wizard._prereq_results.keys()))
+        for key in ('second', 'third', 'fourth'):
+            self.assertNotEqual(threading.current_thread().ident, self.wizard.steps[key].calls[0])
+        self.assertEqual([], self.wizard.steps['first'].calls)
+
+    def test_remembers_prereq_missing_from_thread_pool(self):
+        self.wizard.set_prereq_concurrency(2)
+        self.wizard.evaluate_prereqs(['second', 'third'])
+        self.assertEqual(None, self.wizard.check_prereq('second'))
+        self.assertEqual('first', self.wizard.check_prereq('third').step)
+        self.assertEqual(1, len(self.wizard.steps['third'].calls))
+
+    def test_does_not_use_thread_pool_for_single_independent_step(self):
+        self.wizard.set_prereq_concurrency(2)
+        self.wizard.evaluate_prereqs(['first', 'second'])
+        self.assertEqual({}, self.wizard._prereq_results)
+
+    def test_does_not_evaluate_prereqs_already_checked(self):
+        self.wizard.set_prereq_concurrency(2)
+        self.wizard.check_prereq('second')
+        self.wizard.evaluate_prereqs(['second', 'third', 'fourth'])
+        self.assertEqual(1, len(self.wizard.steps['second'].calls))
+
+    def test_exceptions_from_thread_pool_are_raised(self):
+        self.wizard.set_prereq_concurrency(2)
+        with mock.patch.object(IndependentStep, 'prereq', mock.Mock(side_effect=ValueError)):
+            self.assertRaises(ValueError, self.wizard.evaluate_prereqs, ['second', 'fourth'])
+
+    def test_navigation_is_the_same_as_evaluating_prereqs_one_by_one(self):
+        serial = wizard.Wizard('test:test1', self.steps)
+        serial.initialize_steps()
+        serial_steps = [key for key, _ in serial.get_available_steps()]
+
+        self.wizard.set_prereq_concurrency(3)
+        self.assertEqual(serial_steps, [key for key, _ in self.wizard.get_available_steps()])
+        self.assertEqual(serial.handle_prereq('third', 1), self.wizard.handle_prereq('third', 1))
+
+    def test_records_timings_for_prereqs_run_on_thread_pool(self):
+        self.wizard.set_prereq_concurrency(2)
+        self.wizard.timings = instrumentation.Timings()
+        self.wizard.evaluate_prereqs(['second', 'third'])
+        self.assertEqual(2, self.wizard.timings.phases['prereq'][0])
+
+    def test_closes_database_connections_after_prereq_on_thread_pool(self):
+        connection = mock.Mock()
+        with mock.patch.object(wizard, 'connections', mock.Mock(all=mock.Mock(return_value=[connection]))):
+            wizard.run_prereq(self.wizard.get_step_object_by_key('third'))
+        connection.close.assert_called_once_with()
+
+    @mock.patch('django.contrib.messages.add_message')
+    def test_adds_prereq_messages_from_request_thread(self, add_message):
+        request = mock.Mock()
+        threads = []
+        add_message.side_effect = lambda *args: threads.append(threading.current_thread().ident)
+        missing = mock.Mock(side_effect=lambda: self.raise_missing(request))
+        self.wizard.set_prereq_concurrency(2)
+        with mock.patch.object(IndependentStep, 'prereq', missing):
+            self.wizard.evaluate_prereqs(['second', 'fourth'])
+        self.assertEqual([((request, messages.ERROR, 'message'), {})] * 2, add_message.call_args_list)
+        self.assertEqual([threading.current_thread().ident] * 2, threads)
+
+    def raise_missing(self, request):
+        raise wizard.PrereqMissing('first', request, 'message')
+
+    def test_shares_thread_pool_of_the_same_size(self):
+        self.assertEqual(get_thread_pool(2), get_thread_pool(2))
+        self.assertNotEqual(get_thread_pool(2), get_thread_pool(3))
+
+
+class PrefetchingStep(TestStepTwo):
+
+    def prefetch(self):
+        self.calls.append('prefetch')
+        return 'loaded'
+
+    def display(self):
+        self.calls.append(('display', getattr(self, 'prefetched', None)))
+
+
+class PrefetchingDisplayStep(TestStepTwo):
+    prefetch_display = True
+
+    def display(self):
+        self.calls.append('display')
+        return {'loaded': True}
+
+
+class TestWizardPrefetch(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        self.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.clear()
+
+    def get_wizard(self, second_step):
+        test_wizard = wizard.Wizard('test:test1', [('first', TestStepOne), ('second', second_step)])
+        test_wizard.set_prefetch(self.cache, timeout=10)
+        return test_wizard
+
+    def get_request(self, method='get', session_key='session-key'):
+        data = {'wizard_next': 'Next'} if method == 'post' else {}
+        request = getattr(RequestFactory(), method)('/', data)
+        request.session = mock.Mock(session_key=session_key)
+        return request
+
+    def test_prefetch_is_off_by_default(self):
+        self.assertEqual(None, wizard.Wizard('test:test1', []).prefetch_cache)
+
+    def test_set_prefetch_uses_cache_alias(self):
+        test_wizard = wizard.Wizard('test:test1', [])
+        test_wizard.set_prefetch('default', timeout=5)
+        self.assertTrue(test_wizard.prefetch_cache is not None)
+        self.assertEqual(5, test_wizard.prefetch_timeout)
+
+    def test_prefetches_next_step_after_save(self):
+        test_wizard = self.get_wizard(PrefetchingStep)
+        request = self.get_request('post')
+        test_wizard.handle_request(request, 'first')
+
+        self.assertEqual(['prereq', 'prefetch'], test_wizard.steps['second'].calls)
+        key = test_wizard.get_prefetch_key(request, 'second')
+        self.assertEqual(('prefetch', 'loaded'), self.cache.get(key))
+
+    def test_get_hands_prefetched_data_to_step_and_uses_it_once(self):
+        self.get_wizard(PrefetchingStep).handle_request(self.get_request('post'), 'first')
+
+        test_wizard = self.get_wizard(PrefetchingStep)
+        test_wizard.handle_request(self.get_request(), 'second')
+        self.assertEqual(('display', 'loaded'), test_wizard.steps['second'].calls[-2])
+
+        test_wizard = self.get_wizard(PrefetchingStep)
+        test_wizard.handle_request(self.get_request(), 'second')
+        self.assertEqual(('display', None), test_wizard.steps['second'].calls[-2])
+
+    def test_get_uses_prefetched_display_instead_of_calling_display(self):
+        self.get_wizard(PrefetchingDisplayStep).handle_request(self.get_request('post'), 'first')
+
+        test_wizard = self.get_wizard(PrefetchingDisplayStep)
+        with mock.patch.object(test_wizard, 'render') as render:
+            test_wizard.handle_request(self.get_request(), 'second')
+        self.assertEqual(['prereq'], test_wizard.steps['second'].calls)
+        self.assertEqual(True, render.call_args[0][1]['loaded'])
+
+    def test_prefetched_data_is_kept_per_user(self):
+        self.get_wizard(PrefetchingStep).handle_request(self.get_request('post'), 'first')
+
+        test_wizard = self.get_wizard(PrefetchingStep)
+        test_wizard.handle_request(self.get_request(session_key='other-key'), 'second')
+        self.assertEqual(('display', None), test_wizard.steps['second'].calls[-2])
+
+    def test_does_not_prefetch_without_a_user_to_keep_it_for(self):
+        request = self.get_request('post', session_key=None)
+        request.user = mock.Mock(is_authenticated=mock.Mock(return_value=False))
+        test_wizard = self.get_wizard(PrefetchingStep)
+        test_wizard.handle_request(request, 'first')
+        self.assertEqual(['prereq'], test_wizard.steps['second'].calls)
+
+    def test_uses_user_id_without_a_session(self):
+        test_wizard = self.get_wizard(PrefetchingStep)
+        keys = []
+        for pk in (5, 6):
+            request = self.get_request(session_key=None)
+            request.user = mock.Mock(pk=pk, is_authenticated=mock.Mock(return_value=True))
+            keys.append(test_wizard.get_prefetch_key(request, 'second'))
+        self.assertNotEqual(None, keys[0])
+        self.assertNotEqual(keys[0], keys[1])
+
+    def test_does_not_prefetch_steps_without_prefetch(self):
+        test_wizard = self.get_wizard(TestStepTwo)
+        test_wizard.handle_request(self.get_request('post'), 'first')
+        self.assertEqual(['prereq'], test_wizard.steps['second'].calls)
+
+    def test_failing_prefetch_does_not_fail_the_save(self):
+        test_wizard = self.get_wizard(PrefetchingStep)
+        with mock.patch.object(PrefetchingStep, 'prefetch', mock.Mock(side_effect=ValueError)):
+            response = test_wizard.handle_request(self.get_request('post'), 'first')
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(['save'], test_wizard.steps['first'].calls[-1:])
+
+
+class ConditionalStep(TestStepOne):
+
+    def etag(self):
+        self.calls.append('etag')
+        return 'v1'
+
+    def last_modified(self):
+        return datetime.datetime(2012, 1, 1, 12, 0, 0)
+
+
+class TestWizardConditionalGet(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        self.wizard = wizard.Wizard('test:test1', [('first', ConditionalStep), ('second', TestStepTwo)])
+
+    def get(self, step='first', **headers):
+        return self.wizard.handle_request(RequestFactory().get('/', **headers), step)
+
+    def test_adds_validators_and_private_cache_headers(self):
+        response = self.get()
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('"v1"', response['ETag'])
+        self.assertEqual('Sun, 01 Jan 2012 12:00:00 GMT', response['Last-Modified'])
+        self.assertEqual('private', response['Cache-Control'])
+        self.assertEqual('Cookie, X-Wizard-Partial', response['Vary'])
+
+    def test_answers_matching_if_none_match_with_not_modified_without_display(self):
+        response = self.get(HTTP_IF_NONE_MATCH='"v1"')
+        self.assertEqual(304, response.status_code)
+        self.assertEqual('"v1"', response['ETag'])
+        self.assertEqual(['prereq', 'etag'], self.wizard.steps['first'].calls)
+
+    def test_renders_step_when_etag_does_not_match(self):
+        response = self.get(HTTP_IF_NONE_MATCH='"v0"')
+        self.assertEqual(200, response.status_code)
+        self.assertTrue('display' in self.wizard.steps['first'].calls)
+
+    def test_answers_if_modified_since_with_not_modified(self):
+        response = self.get(HTTP_IF_MODIFIED_SINCE='Sun, 01 Jan 2012 12:00:00 GMT')
+        self.assertEqual(304, response.status_code)
+
+    def test_renders_step_modified_since(self):
+        response = self.get(HTTP_IF_MODIFIED_SINCE='Sun, 01 Jan 2012 11:59:59 GMT')
+        self.assertEqual(200, response.status_code)
+
+    def test_if_none_match_takes_precedence_over_if_modified_since(self):
+        response = self.get(HTTP_IF_NONE_MATCH='"v0"', HTTP_IF_MODIFIED_SINCE='Sun, 01 Jan 2012 12:00:00 GMT')
+        self.assertEqual(200, response.status_code)
+
+    def test_leaves_steps_without_validators_alone(self):
+        response = self.get('second', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Cache-Control'))
+
+
+class CachedRenderStep(TestStepOne):
+    render_cache_dependencies = ('first',)
+
+    def render_cache_key(self):
+        return 'version-1'
+
+    def display(self):
+        self.calls.append('display')
+        return {'items': [1, 2]}
+
+    def template(self):
+        return Template("{% for item in items %}{{ item }}{% endfor %}")
+
+
+class TestWizardRenderCache(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        self.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.clear()
+
+    def tearDown(self):
+        wizard.signals.wizard_post_save.disconnect(dispatch_uid='wizard.invalidate_render_cache')
+
+    def handle(self, step, method='get', session_key='session-key'):
+        data = {'wizard_save': 'Save'} if method == 'post' else {}
+        request = getattr(RequestFactory(), method)('/', data)
+        request.session = mock.Mock(session_key=session_key)
+        self.wizard = wizard.Wizard('test:test1', [('first', TestStepOne), ('review', CachedRenderStep)])
+        self.wizard.set_render_cache(self.cache, timeout=60)
+        return self.wizard.handle_request(request, step)
+
+    def test_render_cache_is_off_by_default(self):
+        self.assertEqual(None, wizard.Wizard('test:test1', []).render_cache)
+
+    def test_renders_step_and_keeps_page_in_cache(self):
+        response = self.handle('review')
+        self.assertEqual('12', response.content)
+        self.assertEqual(['prereq', 'display'], self.wizard.steps['review'].calls)
+
+    def test_uses_cached_page_without_display_or_render(self):
+        self.handle('review')
+        with mock.patch.object(wizard.Wizard, 'render') as render:
+            response = self.handle('review')
+        self.assertEqual('12', response.content)
+        self.assertEqual(['prereq'], self.wizard.steps['review'].calls)
+        self.assertFalse(render.called)
+
+    def test_cached_page_depends_on_step_cache_key(self):
+        self.handle('review')
+        with mock.patch.object(CachedRenderStep, 'render_cache_key', mock.Mock(return_value='version-2')):
+            self.handle('review')
+        self.assertEqual(['prereq', 'display'], self.wizard.steps['review'].calls)
+
+    def test_does_not_cache_when_step_cache_key_is_none(self):
+        with mock.patch.object(CachedRenderStep, 'render_cache_key', mock.Mock(return_value=None)):
+            self.handle('review')
+            self.handle('review')
+        self.assertEqual(['prereq', 'display'], self.wizard.steps['review'].calls)
+
+    def test_saving_the_step_throws_cached_page_away(self):
+        self.handle('review')
+        self.handle('review', method='post')
+        self.handle('review')
+        self.assertEqual(['prereq', 'display'], self.wizard.steps['review'].calls)
+
+    def test_saving_a_dependency_throws_cached_page_away(self):
+        self.handle('review')
+        self.handle('first', method='post')
+        self.handle('review')
+        self.assertEqual(['prereq', 'display'], self.wizard.steps['review'].calls)
+
+    def test_saving_throws_away_only_the_users_cached_pages(self):
+        self.handle('review')
+        self.handle('first', method='post', session_key='other-key')
+        self.handle('review')
+        self.assertEqual(['prereq'], self.wizard.steps['review'].calls)
+
+    def test_does_not_cache_pages_of_users_without_a_session(self):
+        self.handle('review', session_key=None)
+        self.handle('review', session_key=None)
+        self.assertEqual(['prereq', 'display'], self.wizard.steps['review'].calls)
+        self.assertEqual(None, self.wizard.get_render_cache_key('review'))
+
+    def test_uses_step_render_cache_timeout(self):
+        self.handle('review')
+        cache = mock.Mock(get_many=mock.Mock(return_value={}), get=mock.Mock(return_value=None))
+        self.wizard.render_cache = cache
+        with mock.patch.object(CachedRenderStep, 'render_cache_timeout', 5, create=True):
+            self.wizard.render_step(self.wizard.request, 'review')
+        self.assertEqual(5, cache.set.call_args[0][2])
+
+
+class StreamingStep(TestStepOne):
+    streaming = True
+
+    def display(self):
+        return {'items': [1, 2, 3]}
+
+    def template(self):
+        return Template("<ul>{% for item in items %}<li>{{ item }}</li>{% endfor %}</ul>{{ step_key }}")
+
+
+class IteratorStreamingStep(StreamingStep):
+
+    def stream(self, context):
+        for item in context['items']:
+            self.calls.append(item)
+            yield '%s,' % item
+
+
+class TestWizardStreaming(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def handle(self, step_class):
+        self.wizard = wizard.Wizard('test:test1', [('first', step_class)])
+        return self.wizard.handle_request(RequestFactory().get('/'), 'first')
+
+    def test_streams_template_in_chunks(self):
+        response = self.handle(StreamingStep)
+        chunks = list(response)
+        self.assertEqual(['<ul>', '<li>1</li><li>2</li><li>3</li>', '</ul>', 'first'], chunks)
+
+    def test_streams_step_iterator_while_response_is_sent(self):
+        response = self.handle(IteratorStreamingStep)
+        self.assertEqual(['prereq'], self.wizard.steps['first'].calls)
+        self.assertEqual('1,2,3,', ''.join(response))
+        self.assertEqual(['prereq', 1, 2, 3], self.wizard.steps['first'].calls)
+
+    def test_does_not_stream_by_default(self):
+        response = self.handle(SampleStep)
+        self.assertFalse(response._base_content_is_iter)
+
+    def test_stream_template_renders_the_same_as_the_template(self):
+        template = StreamingStep().template()
+        context = Context({'items': [1, 2], 'step_key': 'first'})
+        self.assertEqual(template.render(context), ''.join(wizard.stream_template(template, context)))
+
+    def test_does_not_cache_render_of_streaming_steps(self):
+        test_wizard = wizard.Wizard('test:test1', [('first', StreamingStep)])
+        test_wizard.set_render_cache(mock.Mock())
+        test_wizard.initialize_steps()
+        with mock.patch.object(StreamingStep, 'render_cache_key', create=True):
+            self.assertEqual(None, test_wizard.get_render_cache_key('first'))
+        wizard.signals.wizard_post_save.disconnect(dispatch_uid='wizard.invalidate_render_cache')
+
+
+class FragmentStep(TestStepTwo):
+
+    def display(self):
+        return {'items': [1, 2]}
+
+    def template(self):
+        return Template("<html>{% for item in items %}{{ item }}{% endfor %}</html>")
+
+    def fragment_template(self):
+        return Template("{{ step_key }}:{% for item in items %}{{ item }}{% endfor %}")
+
+
+class TestWizardPartial(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        self.wizard = wizard.Wizard('test:test1', [
+            ('first', TestStepOne),
+            ('second', FragmentStep),
+            ('third', TestStepThree),
+        ])
+
+    def test_is_partial_with_header_or_parameter(self):
+        self.assertTrue(self.wizard.is_partial(RequestFactory().get('/', HTTP_X_WIZARD_PARTIAL='1')))
+        self.assertTrue(self.wizard.is_partial(RequestFactory().get('/', {'wizard_partial': '1'})))
+        self.assertFalse(self.wizard.is_partial(RequestFactory().get('/')))
+
+    def test_renders_full_page_without_partial(self):
+        response = self.wizard.handle_request(RequestFactory().get('/'), 'second')
+        self.assertEqual('<html>12</html>', response.content)
+        self.assertFalse(response.has_header('X-Wizard-Step'))
+
+    def test_renders_fragment_with_navigation_headers(self):
+        request = RequestFactory().get('/', HTTP_X_WIZARD_PARTIAL='1')
+        response = self.wizard.handle_request(request, 'second')
+        self.assertEqual('second:12', response.content)
+        self.assertEqual('second', response['X-Wizard-Step'])
+        self.assertEqual('2', response['X-Wizard-Step-Number'])
+        self.assertEqual('3', response['X-Wizard-Total-Steps'])
+        self.assertEqual('/test/third', response['X-Wizard-Next-Url'])
+        self.assertEqual('/test/first', response['X-Wizard-Prev-Url'])
+
+    def test_fragment_context_has_csrf_token_but_no_context_processors(self):
+        request = RequestFactory().get('/', HTTP_X_WIZARD_PARTIAL='1')
+        self.wizard.handle_request(request, 'second')
+        with mock.patch.object(wizard, 'Context') as context:
+            context.return_value = Context()
+            with mock.patch.object(FragmentStep, 'fragment_template') as fragment_template:
+                self.wizard.render(request, {'items': []}, 'second')
+        context.assert_called_once_with({'items': []})
+        self.assertTrue('csrf_token' in context.return_value)
+        fragment_template.return_value.render.assert_called_once_with(context.return_value)
+
+    def test_adds_navigation_headers_to_fragment_from_render_cache(self):
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        cache.clear()
+        self.wizard.set_render_cache(cache)
+        try:
+            with mock.patch.object(FragmentStep, 'render_cache_key', create=True, return_value='version-1'):
+                for _ in range(2):
+                    request = RequestFactory().get('/', HTTP_X_WIZARD_PARTIAL='1')
+                    request.session = mock.Mock(session_key='session-key')
+                    response = self.wizard.handle_request(request, 'second')
+        finally:
+            wizard.signals.wizard_post_save.disconnect(dispatch_uid='wizard.invalidate_render_cache')
+        self.assertEqual(['prereq'], self.wizard.steps['second'].calls)
+        self.assertEqual('second:12', response.content)
+        self.assertEqual('second', response['X-Wizard-Step'])
+        self.assertEqual('2', response['X-Wizard-Step-Number'])
+        self.assertEqual('3', response['X-Wizard-Total-Steps'])
+        self.assertEqual('/test/third', response['X-Wizard-Next-Url'])
+        self.assertEqual('/test/first', response['X-Wizard-Prev-Url'])
+
+    def test_leaves_out_urls_at_the_ends_of_the_wizard(self):
+        request = RequestFactory().get('/', HTTP_X_WIZARD_PARTIAL='1')
+        response = self.wizard.handle_request(request, 'first')
+        self.assertEqual('/test/second', response['X-Wizard-Next-Url'])
+        self.assertFalse(response.has_header('X-Wizard-Prev-Url'))
+
+    def test_loads_fragment_template_by_name(self):
+        self.wizard.initialize_steps()
+        step = self.wizard.get_step_object_by_key('first')
+        step.fragment_template_name = 'fragment.html'
+        with mock.patch('django.template.loader.get_template') as get_template:
+            self.assertEqual(get_template.return_value, self.wizard.get_fragment_template(step))
+        get_template.assert_called_once_with('fragment.html')
+
+    def test_redirects_keep_partial_parameter(self):
+        request = RequestFactory().post('/', {'wizard_partial': '1', 'wizard_next': 'Next'})
+        response = self.wizard.handle_request(request, 'first')
+        self.assertEqual('/test/second?wizard_partial=1', response['Location'])
+
+
+class TestWizardInlineAdvance(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        self.wizard = wizard.Wizard('test:test1', [
+            ('first', TestStepOne),
+            ('second', FragmentStep),
+            ('third', TestStepThree),
+        ])
+        self.wizard.set_inline_advance()
+
+    def post(self, step='first', **extra):
+        request = RequestFactory().post('/', {'wizard_next': 'Next'}, **extra)
+        return self.wizard.handle_request(request, step)
+
+    def test_inline_advance_is_off_by_default(self):
+        self.assertEqual(False, wizard.Wizard('test:test1', []).inline_advance)
+
+    def test_renders_next_step_for_ajax_post(self):
+        response = self.post(HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('<html>12</html>', response.content)
+        self.assertEqual('/test/second', response['X-Wizard-Location'])
+        self.assertEqual(['save'], self.wizard.steps['first'].calls)
+        self.assertEqual('second', self.wizard._current_step)
+        self.assertEqual('second', self.wizard.steps['second']._current_step)
+
+    def test_does_not_set_current_step_on_step_classes(self):
+        self.post(HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(TestStepThree, self.wizard.steps['third'])
+        self.assertFalse('_current_step' in TestStepThree.__dict__)
+
+    def test_renders_next_step_fragment_for_partial_post(self):
+        response = self.post(HTTP_X_WIZARD_PARTIAL='1')
+        self.assertEqual('second:12', response.content)
+        self.assertEqual('/test/second', response['X-Wizard-Location'])
+        self.assertEqual('/test/first', response['X-Wizard-Prev-Url'])
+
+    def test_renders_step_the_prereq_sends_the_wizard_to(self):
+        self.wizard.steps_callback = [
+            ('first', TestStepOne),
+            ('second', get_class_with_missing_prereq('third')),
+            ('third', FragmentStep),
+        ]
+        response = self.post(HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual('/test/third', response['X-Wizard-Location'])
+
+    def test_redirects_other_posts(self):
+        response = self.post()
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(['prereq'], self.wizard.steps['second'].calls)
+
+
+class DataStep(TestStepOne):
+    error = 'bad data'
+
+    def set_data(self, data):
+        self.calls.append(('data', data))
+
+    def save(self):
+        self.calls.append('save')
+        if self.calls[-2] == ('data', {'value': 'bad'}):
+            raise wizard.SaveStepException(self.error)
+
+
+class TestWizardBatch(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        self.wizard = wizard.Wizard('test:test1', [
+            ('first', DataStep),
+            ('second', DataStep),
+            ('third', TestStepThree),
+        ])
+
+    def submit(self, steps):
+        request = RequestFactory().post('/', json.dumps({'steps': steps}), content_type='application/json')
+        response = self.wizard.handle_batch_request(request)
+        return response, json.loads(response.content)
+
+    def test_saves_steps_in_order_and_reports_next_step(self):
+        response, summary = self.submit([{'step': 'first', 'data': {'value': 1}}, {'step': 'second', 'data': {'value': 2}}])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/json', response['Content-Type'])
+        self.assertEqual({'saved': ['first', 'second'], 'failed': None, 'step': 'third', 'url': '/test/third'}, summary)
+        self.assertEqual(['prereq', ('data', {'value': 1}), 'save'], self.wizard.steps['first'].calls)
+        self.assertEqual(['prereq', ('data', {'value': 2}), 'save'], self.wizard.steps['second'].calls)
+
+    def test_stops_at_first_step_failing_to_save(self):
+        response, summary = self.submit([{'step': 'first', 'data': {'value': 'bad'}}, {'step': 'second', 'data': {'value': 2}}])
+        self.assertEqual(400, response.status_code)
+        self.assertEqual([], summary['saved'])
+        self.assertEqual({'step': 'first', 'error': 'save failed', 'message': 'bad data'}, summary['failed'])
+        self.assertEqual('first', summary['step'])
+
+    def test_stops_at_step_with_missing_prereq(self):
+        with mock.patch.object(DataStep, 'prereq', mock.Mock(side_effect=wizard.PrereqMissing('first'))):
+            response, summary = self.submit([{'step': 'second', 'data': {'value': 2}}])
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({'step': 'second', 'error': 'prereq missing', 'message': None, 'redirect': 'first'},
+            summary['failed'])
+
+    def test_rejects_unknown_steps_and_steps_without_set_data(self):
+        response, summary = self.submit([{'step': 'first', 'data': {'value': 1}}, {'step': 'missing'}])
+        self.assertEqual(['first'], summary['saved'])
+        self.assertEqual({'step': 'missing', 'error': 'unknown step'}, summary['failed'])
+        self.assertEqual(None, summary['step'])
+
+        response, summary = self.submit([{'step': 'third', 'data': {'value': 3}}])
+        self.assertEqual({'step': 'third', 'error': 'step does not take data'}, summary['failed'])
+
+    def test_rejects_invalid_payload(self):
+        request = RequestFactory().post('/', 'not json', content_type='application/json')
+        response = self.wizard.handle_batch_request(request)
+        self.assertEqual(400, response.status_code)
+        self.assertEqual({'error': 'invalid payload'}, json.loads(response.content))
+
+    def test_rejects_steps_and_data_of_the_wrong_type(self):
+        for steps in ([{'step': ['first']}], [{'step': 'first', 'data': [1]}], ['first']):
+            request = RequestFactory().post('/', json.dumps({'steps': steps}), content_type='application/json')
+            response = self.wizard.handle_batch_request(request)
+            self.assertEqual(400, response.status_code)
+            self.assertEqual({'error': 'invalid payload'}, json.loads(response.content))
+
+    def test_reports_non_ascii_save_exception_message(self):
+        with mock.patch.object(DataStep, 'error', 'caf\xc3\xa9'):
+            response, summary = self.submit([{'step': 'first', 'data': {'value': 'bad'}}])
+        self.assertEqual(u'caf\xe9', summary['failed']['message'])
+
+    def test_only_accepts_post(self):
+        response = self.wizard.handle_batch_request(RequestFactory().get('/'))
+        self.assertEqual(405, response.status_code)
+
+    def test_sends_save_signals_for_each_step(self):
+        saved = []
+        receiver = lambda sender, step_key, **kwargs: saved.append(step_key)
+        wizard.signals.wizard_post_save.connect(receiver)
+        try:
+            self.submit([{'step': 'first', 'data': {'value': 1}}, {'step': 'second', 'data': {'value': 2}}])
+        finally:
+            wizard.signals.wizard_post_save.disconnect(receiver)
+        self.assertEqual(['first', 'second'], saved)
+
+
+class TestWizardRenderers(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        self.wizard = wizard.Wizard('test:test1', [
+            ('first', TestStepOne),
+            ('second', FragmentStep),
+            ('third', TestStepThree),
+        ])
+        self.wizard.set_common_template_args({'title': 'Wizard'})
+        self.wizard.set_renderers(renderers.TemplateRenderer(), renderers.JSONRenderer())
+
+    def get(self, accept=None):
+        request = RequestFactory().get('/', HTTP_ACCEPT=accept) if accept else RequestFactory().get('/')
+        return self.wizard.handle_request(request, 'second')
+
+    def test_renders_template_by_default(self):
+        default_renderers = wizard.Wizard('test:test1', []).renderers
+        self.assertEqual([renderers.TemplateRenderer], [type(renderer) for renderer in default_renderers])
+        response = self.get()
+        self.assertEqual('<html>12</html>', response.content)
+        self.assertEqual('Accept', response['Vary'])
+
+    def test_renders_json_for_json_requests(self):
+        response = self.get('application/json')
+        self.assertEqual('application/json', response['Content-Type'])
+        self.assertEqual({
+            'step': 'second',
+            'step_number': 2,
+            'total_steps': 3,
+            'next_url': '/test/third',
+            'prev_url': '/test/first',
+            'data': {'items': [1, 2]},
+        }, json.loads(response.content))
+
+    def test_json_leaves_out_common_template_args(self):
+        self.wizard.set_common_template_args({'lookup': object()})
+        response = self.get('application/json')
+        self.assertEqual({'items': [1, 2]}, json.loads(response.content)['data'])
+
+    def test_json_renderer_does_not_load_templates(self):
+        with mock.patch.object(FragmentStep, 'template') as template:
+            self.get('application/json')
+        self.assertFalse(template.called)
+
+    def test_json_renderer_encodes_dates_and_decimals(self):
+        content = renderers.JSONRenderer().encode({'date': datetime.date(2012, 1, 2), 'amount': decimal.Decimal('1.50')})
+        self.assertEqual({'date': '2012-01-02', 'amount': '1.50'}, json.loads(content))
+
+    def test_chooses_most_preferred_media_type(self):
+        request = RequestFactory().get('/', HTTP_ACCEPT='text/html;q=0.5, application/json')
+        self.assertEqual(renderers.JSONRenderer, type(self.wizard.get_renderer(request)))
+        request = RequestFactory().get('/', HTTP_ACCEPT='application/json;q=0.5, text/html')
+        self.assertEqual(renderers.TemplateRenderer, type(self.wizard.get_renderer(request)))
+        request = RequestFactory().get('/', HTTP_ACCEPT='application/*')
+        self.assertEqual(renderers.JSONRenderer, type(self.wizard.get_renderer(request)))
+
+    def test_uses_first_renderer_for_anything_else(self):
+        for accept in ('*/*', 'image/png', 'application/json;q=0'):
+            request = RequestFactory().get('/', HTTP_ACCEPT=accept)
+            self.assertEqual(renderers.TemplateRenderer, type(self.wizard.get_renderer(request)))
+
+    def test_parse_accept_orders_media_types_by_quality(self):
+        self.assertEqual(['application/json', 'text/html', '*/*'],
+            renderers.parse_accept('text/html;q=0.9, */*;q=0.1, application/json'))
+
+
+class CompletableStep(TestStepTwo):
+
+    def is_complete(self):
+        return True
+
+
+class MessagePrereqStep(TestStepThree):
+    request = mock.Mock()
+
+    def prereq(self):
+        raise wizard.PrereqMissing('first', self.request, 'message')
+
+
+class TestWizardNavigation(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        self.wizard = wizard.Wizard('test:test1', [
+            ('first', TestStepOne),
+            ('second', CompletableStep),
+            ('third', MissingIndependentStep),
+            ('fourth', TestStepFour),
+        ])
+        self.wizard.set_state_store(storage.MemoryStateStore({'first': {'name': 'value'}}))
+        self.wizard._current_step = 'second'
+        self.wizard.initialize_steps()
+
+    def test_lists_every_step_with_its_place_in_the_wizard(self):
+        items = [(item.key, item.number, item.url, item.reachable, item.completed, item.current)
+            for item in self.wizard.navigation]
+        self.assertEqual([
+            ('first', 1, '/test/first', True, True, False),
+            ('second', 2, '/test/second', True, True, True),
+            ('third', 3, '/test/third', False, False, False),
+            ('fourth', 4, '/test/fourth', True, False, False),
+        ], items)
+
+    def test_has_current_next_and_previous_items(self):
+        navigation = self.wizard.navigation
+        self.assertEqual('second', navigation.current.key)
+        self.assertEqual('first', navigation.prev.key)
+        self.assertEqual(self.wizard.next_step_url(), navigation.next.url)
+        self.assertEqual(4, len(navigation))
+        self.assertEqual('fourth', navigation[3].key)
+
+    def test_next_and_previous_match_the_wizard_buttons(self):
+        self.wizard._current_step = 'first'
+        self.assertEqual(self.wizard.next_step_url(), self.wizard.navigation.next.url)
+        self.assertEqual(self.wizard.prev_step_url(), None)
+        self.assertEqual(None, self.wizard.navigation.prev)
+
+    def test_is_built_lazily_once_per_request(self):
+        navigation = self.wizard.navigation
+        self.assertEqual(TestStepOne, self.wizard.steps['first'])
+        with mock.patch.object(wizard.Wizard, 'get_url', mock.Mock(return_value='/url')) as get_url:
+            list(navigation)
+            list(navigation)
+            navigation.next, navigation.prev
+        self.assertEqual(4, get_url.call_count)
+        self.assertEqual(navigation, self.wizard.navigation)
+
+    def test_checks_each_prereq_once(self):
+        list(self.wizard.navigation)
+        self.wizard.navigation.prev
+        self.assertEqual(1, self.wizard.steps['fourth'].calls.count('prereq'))
+        self.assertEqual(1, len(self.wizard.steps['third'].calls))
+
+    def test_does_not_change_where_the_wizard_is_going(self):
+        self.wizard.do_redirect = False
+        list(self.wizard.navigation)
+        self.assertEqual(False, self.wizard.do_redirect)
+
+    def test_is_built_again_after_prereq_results_are_cleared(self):
+        navigation = self.wizard.navigation
+        self.wizard.clear_prereq_results()
+        self.assertNotEqual(navigation, self.wizard.navigation)
+
+    @mock.patch('django.contrib.messages.add_message')
+    def test_does_not_add_prereq_messages(self, add_message):
+        self.wizard.steps['third'] = MessagePrereqStep
+        list(self.wizard.navigation)
+        self.wizard.navigation.next
+        self.assertFalse(add_message.called)
+
+    @mock.patch('django.contrib.messages.add_message')
+    def test_adds_prereq_messages_when_the_wizard_goes_through_the_step(self, add_message):
+        self.wizard.steps['third'] = MessagePrereqStep
+        list(self.wizard.navigation)
+        self.assertEqual('first', self.wizard.handle_prereq('third'))
+        add_message.assert_called_once_with(MessagePrereqStep.request, messages.ERROR, 'message')
+
+    def test_is_available_to_templates(self):
+        data = self.wizard.add_wizard_data_to_template({}, 'second')
+        self.assertEqual(self.wizard.navigation, data['navigation'])
+        template = Template("{% for item in navigation %}{{ item.number }}{% if item.current %}*{% endif %} {% endfor %}")
+        self.assertEqual('1 2* 3 4 ', template.render(Context(data)))
+
+
+class TestTemplateData(test.TestCase):
+    urls = 'wizard.test_urls'
+
+    def setUp(self):
+        self.wizard = wizard.Wizard('test:test1', [('first', TestStepOne), ('second', TestStepTwo)])
+        self.common_args = {'title': 'Wizard', 'choices': range(3)}
+        self.wizard.set_common_template_args(self.common_args)
+        self.wizard.initialize_steps()
+
+    def test_does_not_copy_or_change_common_template_args(self):
+        step_data = {'items': [1]}
+        data = self.wizard.add_wizard_data_to_template(step_data, 'first')
+        data['extra'] = 'value'
+        self.assertEqual({'title': 'Wizard', 'choices': range(3)}, self.common_args)
+        self.assertTrue(data.layers[1] is self.common_args)
+        self.assertEqual({'items': [1], 'extra': 'value'}, step_data)
+        self.assertEqual('value', data['extra'])
+
+    def test_works_out_wizard_entries_only_when_used(self):
+        with mock.patch.object(wizard.Wizard, 'get_step_object_by_key') as get_step_object_by_key:
+            data = self.wizard.add_wizard_data_to_template({}, 'first')
+            self.assertEqual('first', data['step_key'])
+            self.assertFalse(get_step_object_by_key.called)
+            data['step']
+            data['step']
+        get_step_object_by_key.assert_called_once_with('first')
+
+    def test_wizard_entries_and_common_args_win_over_step_data(self):
+        data = self.wizard.add_wizard_data_to_template({'title': 'Step', 'step_key': 'other', 'items': [1]}, 'first')
+        self.assertEqual('Wizard', data['title'])
+        self.assertEqual('first', data['step_key'])
+        self.assertEqual([1], data['items'])
+
+    def test_lists_keys_of_every_layer_once(self):
+        data = self.wizard.add_wizard_data_to_template({'title': 'Step'}, 'first')
+        self.assertEqual(['choices', 'navigation', 'step', 'step_key', 'title', 'wizard'], sorted(data.keys()))
+        self.assertEqual(6, len(data))
+
+    def test_renders_through_template_context(self):
+        data = self.wizard.add_wizard_data_to_template({'items': [1, 2]}, 'second')
+        template = Template("{{ title }} {{ step_key }} {% for item in items %}{{ item }}{% endfor %}")
+        self.assertEqual('Wizard second 12', template.render(Context(data)))
+
+    def test_lazy_dict_raises_key_error_for_missing_keys(self):
+        self.assertRaises(KeyError, lambda: context.LazyDict({})['missing'])
+        self.assertEqual(None, context.LazyDict({}).get('missing'))
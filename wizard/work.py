@@ -0,0 +1,115 @@
+"""
+A unit of work lets steps queue up their writes instead of making them in
+save, so the writes of the whole wizard go to the database together, in
+one transaction, when the wizard is finished.
+
+Steps queue writes with ``self._wizard.work.save(instance)``,
+``self._wizard.work.bulk_create(Model, objects)`` or
+``self._wizard.work.call(func, *args, **kwargs)``.
+
+When the wizard has a state store the queued writes are kept in it between
+requests, which pickles them: the instances, objects and arguments must be
+picklable and functions passed to call must be module level functions (not
+lambdas, closures or bound methods).
+"""
+from django.db import transaction
+
+SAVE = 'save'
+BULK_CREATE = 'bulk_create'
+CALL = 'call'
+
+
+class UnitOfWork(object):
+    """
+    Writes queued by steps. Each write is tagged with the key of the step
+    that was saving when it was queued, so the writes of a step whose save
+    fails can be thrown away, and a step saved again replaces its writes.
+    """
+
+    def __init__(self, operations=None):
+        self.operations = list(operations or [])
+        self.modified = False
+        self.current_step = None
+        self._checkpoint = None
+
+    def __len__(self):
+        return len(self.operations)
+
+    def save(self, instance):
+        self._queue(SAVE, instance)
+
+    def bulk_create(self, model, objects):
+        self._queue(BULK_CREATE, (model, list(objects)))
+
+    def call(self, func, *args, **kwargs):
+        """
+        queues func(*args, **kwargs). With a state store func must be a
+        module level function so it can be pickled.
+        """
+        self._queue(CALL, (func, args, kwargs))
+
+    def _queue(self, kind, payload):
+        self.operations.append((self.current_step, kind, payload))
+        self.modified = True
+
+    def begin_step(self, step_key):
+        """called by the wizard before a step saves"""
+        self.current_step = step_key
+        self._checkpoint = len(self.operations)
+
+    def end_step(self):
+        """
+        called by the wizard after a step saved, throws away the writes the
+        step queued the last time it was saved
+        """
+        step_key, checkpoint = self.current_step, self._checkpoint
+        kept = [operation for operation in self.operations[:checkpoint] if operation[0] != step_key]
+        if len(kept) != checkpoint:
+            self.operations = kept + self.operations[checkpoint:]
+            self.modified = True
+        self.current_step = self._checkpoint = None
+
+    def rollback_step(self):
+        """
+        called by the wizard when a step's save fails, throws away only the
+        writes queued since the step started saving
+        """
+        if len(self.operations) != self._checkpoint:
+            del self.operations[self._checkpoint:]
+            self.modified = True
+        self.current_step = self._checkpoint = None
+
+    def flush(self, using=None):
+        """
+        makes every queued write inside one transaction
+        """
+        with transaction.commit_on_success(using=using):
+            self.run(using)
+
+    def run(self, using=None):
+        """
+        makes every queued write in the current transaction. Consecutive
+        bulk_creates for the same model are combined into one.
+        """
+        for kind, payload in self._combined_operations():
+            if kind == SAVE:
+                payload.save(using=using)
+            elif kind == BULK_CREATE:
+                model, objects = payload
+                model.objects.db_manager(using).bulk_create(objects)
+            else:
+                func, args, kwargs = payload
+                func(*args, **kwargs)
+        self.operations = []
+        self.modified = True
+
+    def _combined_operations(self):
+        combined = []
+        for _, kind, payload in self.operations:
+            if kind == BULK_CREATE and combined and combined[-1][0] == BULK_CREATE and combined[-1][1][0] is payload[0]:
+                combined[-1][1][1].extend(payload[1])
+            elif kind == BULK_CREATE:
+                combined.append((kind, (payload[0], list(payload[1]))))
+            else:
+                combined.append((kind, payload))
+        return combined